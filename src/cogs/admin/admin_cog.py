@@ -0,0 +1,69 @@
+import asyncio
+import io
+from datetime import datetime
+from typing import Optional
+
+import discord
+from discord.ext import commands
+
+from cogs.admin.messages import *
+from cogs.admin.profiler import SamplingProfiler, EventLoopLagMonitor
+from cogs.music.admission import queue_admission
+from cogs.music.audio_monitor import playback_monitor
+from cogs.music.ffmpeg_supervisor import ffmpeg_supervisor
+from config import *
+
+
+class AdminCog(commands.Cog):
+
+    def __init__(self, bot: commands.Bot) -> None:
+        self._bot = bot
+        self._profiler = SamplingProfiler(PROFILE_SAMPLING_INTERVAL)
+        self._profiling = False
+        self._lag_monitor = EventLoopLagMonitor(LOOP_LAG_CHECK_INTERVAL, LOOP_LAG_THRESHOLD)
+        self._lag_monitor_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self) -> None:
+        self._lag_monitor_task = asyncio.create_task(self._lag_monitor.run())
+
+    async def cog_unload(self) -> None:
+        if self._lag_monitor_task:
+            self._lag_monitor_task.cancel()
+
+    @commands.command(description=PROFILE_DESCRIPTION)
+    @commands.is_owner()
+    async def profile(self, ctx: commands.Context, seconds: int = DEFAULT_PROFILE_DURATION) -> None:
+        if not 1 <= seconds <= MAX_PROFILE_DURATION:
+            await ctx.send(embed=invalid_duration())
+            return
+        if self._profiling:
+            await ctx.send(embed=profiling_in_progress())
+            return
+        self._profiling = True
+        try:
+            await ctx.send(embed=profiling_started(seconds))
+            profile = await asyncio.to_thread(self._profiler.run, seconds)
+        finally:
+            self._profiling = False
+
+        name = f"profile-{datetime.now():%Y%m%d-%H%M%S}"
+        summary = profile.summary()
+        await ctx.send(embed=profile_summary(summary),
+                       files=[discord.File(io.BytesIO(profile.collapsed().encode()), filename=f"{name}.collapsed"),
+                              discord.File(io.BytesIO(summary.encode()), filename=f"{name}.txt")])
+
+    @commands.command(description=FFMPEG_DESCRIPTION)
+    @commands.is_owner()
+    async def ffmpeg(self, ctx: commands.Context) -> None:
+        await ctx.send(embed=ffmpeg_processes(await ffmpeg_supervisor.stats(),
+                                              ffmpeg_supervisor.max_processes))
+
+    @commands.command(description=PLAYBACK_DESCRIPTION)
+    @commands.is_owner()
+    async def playback(self, ctx: commands.Context) -> None:
+        await ctx.send(embed=playback_stats(await asyncio.to_thread(playback_monitor.summaries)))
+
+    @commands.command(description=QUEUES_DESCRIPTION)
+    @commands.is_owner()
+    async def queues(self, ctx: commands.Context) -> None:
+        await ctx.send(embed=queue_usages(queue_admission))
@@ -0,0 +1,102 @@
+# This file contains the messages that are sent to the owner when they use the admin commands for simplicity.
+
+from discord import Embed
+
+from cogs.music.admission import QueueAdmission
+from cogs.music.audio_monitor import PlaybackSummary
+from cogs.music.ffmpeg_supervisor import FFmpegProcessStats
+
+from config import *
+
+PROFILE_DESCRIPTION = (
+    f"Sample the bot process for the given number of seconds (1-{MAX_PROFILE_DURATION}) and send the profile. "
+    "The attached `.collapsed` file can be opened with speedscope or turned into a flamegraph with flamegraph.pl. "
+    "Only the owner of the bot can use this command.\n"
+    "**Usage**: `!profile [seconds]`"
+)
+
+FFMPEG_DESCRIPTION = (
+    "Show the FFmpeg processes used for playback with their CPU and memory usage. "
+    "Only the owner of the bot can use this command.\n"
+    "**Usage**: `!ffmpeg`"
+)
+
+QUEUES_DESCRIPTION = (
+    "Show how many songs are queued and how much memory the queues take, in total and in the busiest guilds. "
+    "Only the owner of the bot can use this command.\n"
+    "**Usage**: `!queues`"
+)
+
+PLAYBACK_DESCRIPTION = (
+    "Show how smoothly the audio is played in every guild during the last "
+    f"{PLAYBACK_STATS_WINDOW // FRAMES_PER_SECOND} seconds: how long reading a frame takes, how late the frames are sent "
+    "and how many frames had to wait for FFmpeg (underruns). "
+    "Only the owner of the bot can use this command.\n"
+    "**Usage**: `!playback`"
+)
+
+
+def profiling_started(seconds: int) -> Embed:
+    return Embed(title="🔬 Profiling",
+                 description=f"Sampling the bot for {seconds} seconds...",
+                 color=INFO_COLOR)
+
+
+def profile_summary(summary: str) -> Embed:
+    return Embed(title="🔬 Profile",
+                 description=f"```\n{summary[:4000]}\n```",
+                 color=SUCCESS_COLOR)
+
+
+def profiling_in_progress() -> Embed:
+    return Embed(title="⛔ Profiling In Progress",
+                 description="Wait until the current profile is finished",
+                 color=ERROR_COLOR)
+
+
+def invalid_duration() -> Embed:
+    return Embed(title="⛔ Invalid Duration",
+                 description=f"The duration must be between 1 and {MAX_PROFILE_DURATION} seconds",
+                 color=ERROR_COLOR)
+
+
+def ffmpeg_processes(processes: list[FFmpegProcessStats], max_processes: int) -> Embed:
+    def usage(process: FFmpegProcessStats) -> str:
+        cpu = f"{process.cpu_percent:.1f}%" if process.cpu_percent is not None else "?"
+        rss = f"{process.rss_mb:.1f} MB" if process.rss_mb is not None else "?"
+        return f"- `{process.pid}` guild {process.guild_id}: CPU {cpu}, RSS {rss}, running {process.age:.0f}s"
+
+    lines = [usage(process) for process in processes[:20]]
+    lines += [f"**{len(processes) - 20} more processes**"] if len(processes) > 20 else []
+    return Embed(title=f"⚙️ FFmpeg Processes ({len(processes)}/{max_processes})",
+                 description="\n".join(lines) or "No FFmpeg processes running",
+                 color=INFO_COLOR)
+
+
+def playback_stats(summaries: dict[int, PlaybackSummary]) -> Embed:
+    def stats(guild_id: int, summary: PlaybackSummary) -> str:
+        return (f"- guild {guild_id}: read p50/p99 {summary.read_p50:.1f}/{summary.read_p99:.1f} ms, "
+                f"lateness p50/p99 {summary.lateness_p50:.0f}/{summary.lateness_p99:.0f} ms, "
+                f"{summary.underruns} underruns and {summary.late_frames} late of {summary.frames} frames")
+
+    lines = [stats(guild_id, summary) for guild_id, summary in list(summaries.items())[:20]]
+    lines += [f"**{len(summaries) - 20} more guilds**"] if len(summaries) > 20 else []
+    return Embed(title="🎚️ Playback",
+                 description="\n".join(lines) or "Nothing is playing",
+                 color=INFO_COLOR)
+
+
+def queue_usages(admission: QueueAdmission) -> Embed:
+    def megabytes(size: int) -> str:
+        return f"{size / 1024 ** 2:.1f} MB"
+
+    usages = sorted(admission.usages().items(), key=lambda item: item[1].bytes, reverse=True)
+    lines = [f"- guild {guild_id}: {usage.entries}/{admission.max_guild_entries} songs, "
+             f"{megabytes(usage.bytes)}/{megabytes(admission.max_guild_bytes)}" for guild_id, usage in usages[:20]]
+    lines += [f"**{len(usages) - 20} more guilds**"] if len(usages) > 20 else []
+    message = Embed(title="📦 Queues",
+                    description="\n".join(lines) or "All queues are empty",
+                    color=INFO_COLOR)
+    message.add_field(name="Songs", value=f"{admission.total.entries}/{admission.max_total_entries}")
+    message.add_field(name="Memory", value=f"{megabytes(admission.total.bytes)}/{megabytes(admission.max_total_bytes)}")
+    return message
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from dataclasses import dataclass
+from os.path import basename
+from types import FrameType
+from typing import Optional
+
+
+@dataclass
+class Profile:
+    samples: int
+    duration: float
+    stacks: Counter[str]  # collapsed stack: number of samples
+
+    def collapsed(self) -> str:
+        """
+        Stacks in the collapsed format, which can be turned into a flamegraph by flamegraph.pl or speedscope.
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 15) -> str:
+        threads: Counter[str] = Counter()
+        leaves: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            threads[frames[0]] += count
+            leaves[f"{frames[0]}: {frames[-1]}"] += count
+
+        lines = [f"{self.samples} samples in {self.duration:.1f}s", "", "Samples per thread:"]
+        lines += [f"{count / self.samples:6.1%}  {thread}" for thread, count in threads.most_common()]
+        lines += ["", f"Top {top} functions (self):"]
+        lines += [f"{count / self.samples:6.1%}  {leaf}" for leaf, count in leaves.most_common(top)]
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of all threads of the process: the event loop,
+    the worker threads resolving songs and the audio player threads of discord.py.
+    """
+
+    _thread_number_regex = re.compile(r"[_-]?\d+$")
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+
+    def run(self, duration: float) -> Profile:
+        """
+        Blocks for the given duration, should be called in a separate thread.
+        """
+        own_thread = threading.get_ident()
+        stacks: Counter[str] = Counter()
+        samples = 0
+        started_at = time.monotonic()
+        while time.monotonic() - started_at < duration:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    stacks[self._collapse(self._thread_label(threads.get(thread_id)), frame)] += 1
+            samples += 1
+            time.sleep(self._interval)
+        return Profile(samples=samples, duration=time.monotonic() - started_at, stacks=stacks)
+
+    @classmethod
+    def _thread_label(cls, thread: Optional[threading.Thread]) -> str:
+        if thread is None:
+            return "unknown"
+        if thread is threading.main_thread():  # runs the event loop
+            return thread.name
+        if type(thread) is not threading.Thread:  # e.g. AudioPlayer of discord.py
+            return type(thread).__name__
+        # threads of the same pool are merged, e.g. asyncio_0 and asyncio_1
+        return cls._thread_number_regex.sub("", thread.name.split(" ")[0]) or thread.name
+
+    @staticmethod
+    def _collapse(thread_label: str, frame: FrameType) -> str:
+        frames = []
+        while frame:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join([thread_label] + frames[::-1])
+
+
+class EventLoopLagMonitor:
+    """
+    Detects callbacks that block the event loop. The event loop updates a heartbeat periodically,
+    and a watchdog thread logs the stack of the event loop thread when the heartbeat is late.
+    """
+
+    def __init__(self, interval: float, threshold: float) -> None:
+        self._interval = interval
+        self._threshold = threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stopped = threading.Event()
+
+    async def run(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                self._heartbeat = time.monotonic()
+                await asyncio.sleep(self._interval)
+        finally:
+            self._stopped.set()
+
+    def _watch(self) -> None:
+        reported_heartbeat = None
+        while not self._stopped.wait(self._interval):
+            heartbeat = self._heartbeat
+            lag = time.monotonic() - heartbeat - self._interval
+            if lag < self._threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat  # the same stall is reported once
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "unknown"
+            logging.warning(f"Event loop blocked for more than {lag:.2f}s, currently running:\n{stack}")
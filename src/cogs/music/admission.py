@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from typing import Union
+
+from config import MAX_GUILD_QUEUE_LENGTH, MAX_GUILD_QUEUE_BYTES, MAX_QUEUE_LENGTH, MAX_QUEUE_BYTES
+from .song import Song, SongRequest
+
+_ENTRY_OVERHEAD = 600  # bytes, python objects of a queue entry without its strings
+
+
+def estimated_size(entry: Union[Song, SongRequest]) -> int:
+    """
+    Rough memory usage of a queue entry in bytes. Resolved songs are larger, because of their stream URLs.
+    """
+    if isinstance(entry, Song):
+        return _ENTRY_OVERHEAD + len(entry.title) + len(entry.url) + len(entry.thumbnail or "") + \
+            len(entry._stream_url or "")
+    return _ENTRY_OVERHEAD + len(entry.query) + len(entry.title)
+
+
+@dataclass
+class QueueUsage:
+    entries: int = 0
+    bytes: int = 0
+
+
+class QueueAdmission:
+    """
+    Keeps track of the entries waiting in the queues of all guilds, looped songs included, and admits new entries
+    only while both the guild's limits and the limits of the whole bot are met,
+    so a few guilds adding huge playlists can't exhaust the memory and the resolver for everyone else.
+    """
+
+    class LimitReached(Exception):
+        def __init__(self, limit: str, admitted: int) -> None:
+            """
+            :param limit: the limit that was reached, guild_entries, guild_bytes, total_entries or total_bytes
+            :param admitted: number of entries admitted before the limit was reached
+            """
+            super().__init__(f"Queue limit {limit} reached")
+            self.limit = limit
+            self.admitted = admitted
+
+    def __init__(self, max_guild_entries: int, max_guild_bytes: int, max_total_entries: int,
+                 max_total_bytes: int) -> None:
+        self.max_guild_entries = max_guild_entries
+        self.max_guild_bytes = max_guild_bytes
+        self.max_total_entries = max_total_entries
+        self.max_total_bytes = max_total_bytes
+        self._guilds: dict[int, QueueUsage] = {}  # guild_id: usage
+        self._total = QueueUsage()
+
+    def admit(self, guild_id: int, entries: list[Union[Song, SongRequest]]) -> None:
+        """
+        Admits the entries in order until a limit is reached, then raises LimitReached.
+        The entries admitted before it stay admitted, so they have to be added to the queue.
+        """
+        guild = self._guilds.setdefault(guild_id, QueueUsage())
+        for admitted, entry in enumerate(entries):
+            size = estimated_size(entry)
+            limit = self._reached_limit(guild, size)
+            if limit:
+                self._forget_if_unused(guild_id)
+                raise QueueAdmission.LimitReached(limit, admitted)
+            self._add(guild, 1, size)
+
+    def add(self, guild_id: int, entries: list[Union[Song, SongRequest]]) -> None:
+        """
+        Counts the entries without checking the limits, e.g. queues restored after a restart.
+        """
+        self._add(self._guilds.setdefault(guild_id, QueueUsage()), len(entries),
+                  sum(estimated_size(entry) for entry in entries))
+
+    def release(self, guild_id: int, entries: list[Union[Song, SongRequest]]) -> None:
+        guild = self._guilds.get(guild_id)
+        if not guild:
+            return
+        self._add(guild, -len(entries), -sum(estimated_size(entry) for entry in entries))
+        self._forget_if_unused(guild_id)
+
+    def usage(self, guild_id: int) -> QueueUsage:
+        return self._guilds.get(guild_id, QueueUsage())
+
+    def usages(self) -> dict[int, QueueUsage]:
+        return dict(self._guilds)
+
+    @property
+    def total(self) -> QueueUsage:
+        return self._total
+
+    def _reached_limit(self, guild: QueueUsage, size: int) -> str:
+        if guild.entries + 1 > self.max_guild_entries:
+            return "guild_entries"
+        if guild.bytes + size > self.max_guild_bytes:
+            return "guild_bytes"
+        if self._total.entries + 1 > self.max_total_entries:
+            return "total_entries"
+        if self._total.bytes + size > self.max_total_bytes:
+            return "total_bytes"
+        return ""
+
+    def _add(self, guild: QueueUsage, entries: int, size: int) -> None:
+        guild.entries += entries
+        guild.bytes += size
+        self._total.entries += entries
+        self._total.bytes += size
+
+    def _forget_if_unused(self, guild_id: int) -> None:
+        if self._guilds.get(guild_id) == QueueUsage():
+            del self._guilds[guild_id]
+
+
+# shared by the queues of all guilds and the admin commands
+queue_admission = QueueAdmission(MAX_GUILD_QUEUE_LENGTH, MAX_GUILD_QUEUE_BYTES, MAX_QUEUE_LENGTH, MAX_QUEUE_BYTES)
@@ -0,0 +1,149 @@
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+from discord import AudioSource
+from discord.opus import Encoder
+
+from config import FRAMES_PER_SECOND
+
+_FRAME_SAMPLES = Encoder.SAMPLES_PER_FRAME * Encoder.CHANNELS  # interleaved stereo samples in a frame
+_INT16_MIN, _INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+# position of every interleaved sample within a single frame (0 <= x < 1), used to build per-sample fade curves
+_FRAME_RAMP = np.repeat(np.arange(Encoder.SAMPLES_PER_FRAME, dtype=np.float32) / Encoder.SAMPLES_PER_FRAME,
+                        Encoder.CHANNELS)
+
+
+class AudioMixer(AudioSource):
+    """
+    Audio source that wraps the PCM sources of the music player.
+    Applies volume and crossfades between two tracks using vectorized NumPy arithmetic,
+    so the volume can be changed live without restarting FFmpeg.
+    """
+
+    def __init__(self, source: AudioSource, volume: float = 1.0, start_frame: int = 0) -> None:
+        self._source = source
+        self._incoming: Optional[AudioSource] = None
+        self._volume = volume
+        self._fade_frames = 0
+        self._fade_position = 0
+        self._frame = start_frame  # position of the newest track, counted in frames sent to discord
+        self._markers: list[tuple[int, Callable[[], None]]] = []  # sorted by frame
+        self._ended = False
+        self._lock = threading.Lock()  # read() is called from the discord's audio player thread
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        self._volume = max(value, 0.0)
+
+    @property
+    def frame(self) -> int:
+        return self._frame
+
+    @property
+    def position(self) -> float:
+        return self._frame / FRAMES_PER_SECOND
+
+    def set_marker(self, frame: int, callback: Callable[[], None]) -> None:
+        """
+        Calls the callback once the newest track reaches the given frame.
+        The callback is called from the audio player thread.
+        """
+        with self._lock:
+            self._markers.append((frame, callback))
+            self._markers.sort(key=lambda marker: marker[0])
+
+    def crossfade_into(self, source: AudioSource, seconds: float) -> bool:
+        """
+        Starts fading out the current track and fading in the given source.
+        Returns False if the mixer has already run out of audio and the source was not taken.
+        """
+        with self._lock:
+            if self._ended:
+                return False
+            if self._incoming:  # previous crossfade is still in progress, drop the fading out track
+                self._source.cleanup()
+                self._source = self._incoming
+            self._incoming = source
+            self._fade_frames = max(int(seconds * FRAMES_PER_SECOND), 1)
+            self._fade_position = 0
+            self._frame = 0
+            self._markers.clear()
+            return True
+
+    def replace_source(self, source: AudioSource, start_frame: int) -> None:
+        """
+        Replaces the newest track with the given source without interrupting the playback, used for seeking.
+        The source is expected to start at the given frame of the track.
+        """
+        with self._lock:
+            self._source.cleanup()
+            if self._incoming:
+                self._incoming.cleanup()
+                self._incoming = None
+            self._source = source
+            self._frame = start_frame
+            self._fade_position = self._fade_frames  # the new source is not faded in
+
+    def read(self) -> bytes:
+        with self._lock:
+            pcm = self._read_frame(self._source)
+            if self._incoming:
+                pcm = self._crossfade(pcm)
+            elif pcm is not None and self._fade_position < self._fade_frames:  # outgoing track ended mid-fade
+                pcm *= np.sin(self._fade_progress())
+            if pcm is None:
+                self._ended = True
+                return b""
+            self._frame += 1
+            while self._markers and self._frame >= self._markers[0][0]:
+                self._markers.pop(0)[1]()
+            if self._volume != 1.0:
+                pcm *= self._volume
+            return np.clip(pcm, _INT16_MIN, _INT16_MAX).astype(np.int16).tobytes()
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        self._source.cleanup()
+        if self._incoming:
+            self._incoming.cleanup()
+
+    def _crossfade(self, outgoing: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        incoming = self._read_frame(self._incoming)
+        progress = self._fade_progress()
+
+        if outgoing is None:  # only the outgoing track is dropped, the incoming one keeps fading in
+            self._finish_crossfade()
+            return incoming * np.sin(progress) if incoming is not None else None
+        if self._fade_position >= self._fade_frames:
+            self._finish_crossfade()
+        if incoming is None:
+            return outgoing * np.cos(progress)
+        return outgoing * np.cos(progress) + incoming * np.sin(progress)
+
+    def _fade_progress(self) -> np.ndarray:
+        # equal power fade, so the loudness does not dip in the middle of the crossfade
+        progress = np.minimum((self._fade_position + _FRAME_RAMP) / self._fade_frames, 1.0) * (np.pi / 2)
+        self._fade_position += 1
+        return progress
+
+    def _finish_crossfade(self) -> None:
+        self._source.cleanup()
+        self._source = self._incoming
+        self._incoming = None
+
+    @staticmethod
+    def _read_frame(source: AudioSource) -> Optional[np.ndarray]:
+        data = source.read()
+        if not data:
+            return None
+        samples = np.frombuffer(data, dtype=np.int16)
+        if samples.size < _FRAME_SAMPLES:  # the last frame of the stream may be incomplete
+            samples = np.pad(samples, (0, _FRAME_SAMPLES - samples.size))
+        return samples.astype(np.float32)
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from discord import AudioSource
+
+from config import FRAMES_PER_SECOND, PLAYBACK_STATS_WINDOW, MAX_UNDERRUN_RATIO, MAX_FRAME_LATENESS
+from .ffmpeg_supervisor import ffmpeg_supervisor
+
+_FRAME_DURATION = 1 / FRAMES_PER_SECOND
+_PAUSE_GAP = 0.5  # seconds between two reads after which the player is considered paused
+
+
+@dataclass
+class PlaybackSummary:
+    frames: int  # frames in the window
+    underruns: int  # reads that waited for FFmpeg longer than a frame lasts
+    late_frames: int  # frames read later than one frame after their schedule
+    read_p50: float  # ms
+    read_p99: float  # ms
+    lateness_p50: float  # ms
+    lateness_p99: float  # ms
+
+
+class PlaybackStats:
+    """
+    Timings of the latest frames read by discord's audio player for a single guild.
+    """
+
+    def __init__(self, window: int) -> None:
+        self._read_times: deque[float] = deque(maxlen=window)
+        self._lateness: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.total_frames = 0
+        self.total_underruns = 0
+
+    def record(self, read_time: float, lateness: float) -> None:
+        with self._lock:
+            self._read_times.append(read_time)
+            self._lateness.append(lateness)
+            self.total_frames += 1
+            if read_time > _FRAME_DURATION:
+                self.total_underruns += 1
+
+    def summary(self) -> Optional[PlaybackSummary]:
+        import numpy as np  # imported with the music cog after logging in, the admin cog is loaded before
+        with self._lock:
+            if not self._read_times:
+                return None
+            read_times = np.array(self._read_times) * 1000
+            lateness = np.array(self._lateness) * 1000
+        read_p50, read_p99 = np.percentile(read_times, [50, 99])
+        lateness_p50, lateness_p99 = np.percentile(lateness, [50, 99])
+        return PlaybackSummary(frames=len(read_times),
+                               underruns=int(np.count_nonzero(read_times > _FRAME_DURATION * 1000)),
+                               late_frames=int(np.count_nonzero(lateness > _FRAME_DURATION * 1000)),
+                               read_p50=float(read_p50),
+                               read_p99=float(read_p99),
+                               lateness_p50=float(lateness_p50),
+                               lateness_p99=float(lateness_p99))
+
+
+class MonitoredSource(AudioSource):
+    """
+    Wraps the source handed to the voice client and measures how long every read takes
+    and how late every frame is compared to discord's 20 ms schedule.
+    """
+
+    def __init__(self, source: AudioSource, stats: PlaybackStats) -> None:
+        self._source = source
+        self._stats = stats
+        self._schedule_start: Optional[float] = None
+        self._scheduled_frames = 0
+        self._last_read: Optional[float] = None
+
+    def read(self) -> bytes:
+        started_at = time.perf_counter()
+        if self._last_read is None or started_at - self._last_read > _PAUSE_GAP:
+            # the audio player restarts its schedule after pausing or reconnecting
+            self._schedule_start = started_at
+            self._scheduled_frames = 0
+        lateness = max(started_at - (self._schedule_start + self._scheduled_frames * _FRAME_DURATION), 0.0)
+        data = self._source.read()
+        self._last_read = time.perf_counter()
+        self._scheduled_frames += 1
+        if data:
+            self._stats.record(self._last_read - started_at, lateness)
+        return data
+
+    def restart_schedule(self) -> None:
+        """
+        Called when the player is resumed, discord's audio player restarts its schedule then,
+        shorter pauses would count every following frame as late.
+        """
+        self._last_read = None
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self) -> None:
+        self._source.cleanup()
+
+
+class PlaybackMonitor:
+    """
+    Collects playback timings of all guilds and warns about the ones that are likely to stutter.
+    """
+
+    def __init__(self, window: int, max_underrun_ratio: float, max_lateness: float) -> None:
+        """
+        :param max_underrun_ratio: part of the frames in the window that may wait for FFmpeg
+        :param max_lateness: ms, the 99th percentile of frame lateness above which a guild stutters
+        """
+        self._window = window
+        self._max_underrun_ratio = max_underrun_ratio
+        self._max_lateness = max_lateness
+        self._stats: dict[int, PlaybackStats] = {}  # guild_id: stats
+        self._checked_frames: dict[int, int] = {}  # guild_id: total frames at the previous check
+
+    def wrap(self, guild_id: int, source: AudioSource) -> MonitoredSource:
+        stats = self._stats.setdefault(guild_id, PlaybackStats(self._window))
+        return MonitoredSource(source, stats)
+
+    def remove(self, guild_id: int) -> None:
+        self._stats.pop(guild_id, None)
+        self._checked_frames.pop(guild_id, None)
+
+    def summaries(self) -> dict[int, PlaybackSummary]:
+        summaries = {guild_id: stats.summary() for guild_id, stats in list(self._stats.items())}
+        return {guild_id: summary for guild_id, summary in summaries.items() if summary}
+
+    def check(self) -> None:
+        for guild_id, summary in self.summaries().items():
+            total_frames = self._stats[guild_id].total_frames
+            if self._checked_frames.get(guild_id) == total_frames:  # paused, the window was already checked
+                continue
+            self._checked_frames[guild_id] = total_frames
+            underrun_ratio = summary.underruns / summary.frames
+            if underrun_ratio > self._max_underrun_ratio or summary.lateness_p99 > self._max_lateness:
+                load = os.getloadavg()[0] if hasattr(os, "getloadavg") else float("nan")
+                logging.warning(f"Playback of guild {guild_id} may stutter: "
+                                f"{underrun_ratio:.1%} underruns, lateness p99 {summary.lateness_p99:.0f} ms, "
+                                f"read p99 {summary.read_p99:.1f} ms "
+                                f"(load average {load:.2f}, {ffmpeg_supervisor.process_count} FFmpeg processes)")
+
+
+# shared by the music players of all guilds and the admin commands
+playback_monitor = PlaybackMonitor(PLAYBACK_STATS_WINDOW, MAX_UNDERRUN_RATIO, MAX_FRAME_LATENESS)
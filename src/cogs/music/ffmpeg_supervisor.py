@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Collection, Optional
+
+from discord import AudioSource, FFmpegPCMAudio
+
+from config import MAX_FFMPEG_PROCESSES, FFMPEG_STALL_TIMEOUT, FFMPEG_ORPHAN_TIMEOUT
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+@dataclass
+class FFmpegProcessStats:
+    guild_id: int
+    pid: int
+    age: float  # seconds
+    cpu_percent: Optional[float]
+    rss_mb: Optional[float]
+    reading: bool
+
+
+class SupervisedSource(AudioSource):
+    """
+    FFmpeg audio source tracked by the supervisor. Frees its slot when cleaned up.
+    """
+
+    def __init__(self, source: FFmpegPCMAudio, guild_id: int, release: Callable[[], None]) -> None:
+        self._source = source
+        self.guild_id = guild_id
+        self.created_at = time.monotonic()
+        self.read_started_at: Optional[float] = None  # set while waiting for FFmpeg's output
+        self.frames_read = 0
+        self._release = release
+        self._cleaned_up = False
+        self._lock = threading.Lock()
+        self._cpu_sample: Optional[tuple[float, float]] = None  # (time, cpu seconds) of the previous check
+
+    @property
+    def pid(self) -> Optional[int]:
+        process = getattr(self._source, "_process", None)  # discord.py does not expose the FFmpeg process
+        return process.pid if process else None
+
+    def read(self) -> bytes:
+        self.read_started_at = time.monotonic()
+        data = self._source.read()
+        self.read_started_at = None
+        self.frames_read += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return False
+
+    def kill(self) -> None:
+        # the pending read returns nothing, so the player ends the song and cleans up the source
+        process = getattr(self._source, "_process", None)
+        if process and process.poll() is None:
+            process.kill()
+
+    def cleanup(self) -> None:
+        with self._lock:
+            if self._cleaned_up:
+                return
+            self._cleaned_up = True
+        try:
+            self._source.cleanup()
+        finally:
+            self._release()
+
+    def stats(self) -> FFmpegProcessStats:
+        pid = self.pid
+        cpu_percent, rss_mb = None, None
+        if pid:
+            cpu_seconds, rss_mb = _read_proc_stats(pid)
+            now = time.monotonic()
+            if cpu_seconds is not None and self._cpu_sample:
+                previous_time, previous_cpu = self._cpu_sample
+                cpu_percent = (cpu_seconds - previous_cpu) / max(now - previous_time, 1e-6) * 100
+            if cpu_seconds is not None:
+                self._cpu_sample = (now, cpu_seconds)
+        return FFmpegProcessStats(guild_id=self.guild_id,
+                                  pid=pid or 0,
+                                  age=time.monotonic() - self.created_at,
+                                  cpu_percent=cpu_percent,
+                                  rss_mb=rss_mb,
+                                  reading=self.read_started_at is not None)
+
+
+class FFmpegSupervisor:
+    """
+    Tracks every FFmpeg process spawned for playback and limits how many run at once on the host.
+    Processes stalled on reading the stream are killed, so the song can be resumed,
+    and processes that were never played (e.g. the player stopped while preparing the song) are cleaned up.
+    """
+
+    def __init__(self, max_processes: int, stall_timeout: float, orphan_timeout: float) -> None:
+        self._max_processes = max_processes
+        self._stall_timeout = stall_timeout
+        self._orphan_timeout = orphan_timeout
+        self._slots = asyncio.Semaphore(max_processes)
+        self._sources: set[SupervisedSource] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def spawn(self, guild_id: int, create: Callable[[], Awaitable[FFmpegPCMAudio]]) -> SupervisedSource:
+        """
+        Waits for a free slot and creates the FFmpeg source.
+        """
+        self._loop = asyncio.get_running_loop()
+        if self._slots.locked():
+            logging.warning(f"All {self._max_processes} FFmpeg slots are taken, guild {guild_id} is waiting")
+        await self._slots.acquire()
+        try:
+            source = SupervisedSource(await create(), guild_id, lambda: self._release(source))
+        except BaseException:
+            self._slots.release()
+            raise
+        self._sources.add(source)
+        return source
+
+    def kill_guild(self, guild_id: int) -> None:
+        for source in [source for source in self._sources if source.guild_id == guild_id]:
+            source.kill()
+            source.cleanup()
+
+    def check(self, paused_guilds: Collection[int] = ()) -> None:
+        """
+        :param paused_guilds: guilds whose player is paused, their sources are not read until it resumes
+        """
+        now = time.monotonic()
+        for source in list(self._sources):
+            if source.read_started_at and now - source.read_started_at > self._stall_timeout:
+                logging.warning(f"FFmpeg process {source.pid} of guild {source.guild_id} stalled, killing it")
+                source.kill()
+            elif not source.frames_read and now - source.created_at > self._orphan_timeout and \
+                    source.guild_id not in paused_guilds:
+                logging.warning(f"FFmpeg process {source.pid} of guild {source.guild_id} was never played, "
+                                "cleaning it up")
+                source.cleanup()
+
+    async def stats(self) -> list[FFmpegProcessStats]:
+        # the sources are added and removed on the event loop, only the /proc files are read in a thread
+        sources = list(self._sources)
+        return await asyncio.to_thread(lambda: [source.stats() for source in sources])
+
+    @property
+    def max_processes(self) -> int:
+        return self._max_processes
+
+    @property
+    def process_count(self) -> int:
+        return len(self._sources)
+
+    def _release(self, source: SupervisedSource) -> None:
+        # cleanup is called from the audio player thread
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._release_slot, source)
+
+    def _release_slot(self, source: SupervisedSource) -> None:
+        if source in self._sources:
+            self._sources.discard(source)
+            self._slots.release()
+
+
+# shared by all guilds, the limit applies to the whole host
+ffmpeg_supervisor = FFmpegSupervisor(MAX_FFMPEG_PROCESSES, FFMPEG_STALL_TIMEOUT, FFMPEG_ORPHAN_TIMEOUT)
+
+
+def _read_proc_stats(pid: int) -> tuple[Optional[float], Optional[float]]:
+    """
+    Returns CPU time in seconds and resident memory in MB of the process, read from /proc (Linux only).
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()  # the process name may contain spaces
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS  # utime + stime
+        with open(f"/proc/{pid}/status") as file:
+            rss_kb = next((int(line.split()[1]) for line in file if line.startswith("VmRSS:")), None)
+        return cpu_seconds, rss_kb / 1024 if rss_kb is not None else None
+    except (OSError, ValueError, IndexError):
+        return None, None
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Union
+
+import discord
+from discord.abc import Messageable
+
+from .messages import added_to_queue, added_songs_to_queue
+from .song import Song
+
+AddedSong = tuple[Song, int, float]  # (song, queue length after adding it, seconds until it plays)
+
+
+class MessageBatcher:
+    """
+    Sends messages to text channels in background tasks, one task per channel, so that the caller
+    is never blocked by discord's rate limits. Songs added to the queue within a short time window
+    are announced with a single message.
+    """
+
+    def __init__(self, window: float) -> None:
+        self._window = window
+        self._pending: dict[int, deque[Union[discord.Embed, AddedSong]]] = {}  # channel_id: messages to send
+        self._tasks: set[asyncio.Task] = set()
+
+    def send(self, channel: Messageable, embed: discord.Embed) -> None:
+        self._enqueue(channel, embed)
+
+    def song_added(self, channel: Messageable, song: Song, queue_length: int, eta: float) -> None:
+        self._enqueue(channel, (song, queue_length, eta))
+
+    def _enqueue(self, channel: Messageable, message: Union[discord.Embed, AddedSong]) -> None:
+        pending = self._pending.get(channel.id)
+        if pending is None:
+            pending = self._pending[channel.id] = deque()
+            task = asyncio.create_task(self._send_pending(channel, pending))
+            self._tasks.add(task)  # keeps a reference, so the task is not garbage collected
+            task.add_done_callback(self._tasks.discard)
+        pending.append(message)
+
+    async def _send_pending(self, channel: Messageable, pending: deque[Union[discord.Embed, AddedSong]]) -> None:
+        try:
+            while pending:
+                message = pending.popleft()
+                if isinstance(message, discord.Embed):
+                    await self._send(channel, message)
+                    continue
+                await asyncio.sleep(self._window)  # wait for other songs added in the meantime
+                songs = [message]
+                while pending and not isinstance(pending[0], discord.Embed):
+                    songs.append(pending.popleft())
+                if len(songs) == 1:
+                    await self._send(channel, added_to_queue(*message))
+                else:
+                    await self._send(channel, added_songs_to_queue([song for song, _, _ in songs], songs[-1][1],
+                                                                   songs[0][2]))
+        finally:
+            del self._pending[channel.id]
+
+    @staticmethod
+    async def _send(channel: Messageable, embed: discord.Embed) -> None:
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to send message to channel {channel.id}: {e}")
@@ -1,9 +1,14 @@
 # This file contains the messages that are sent to the user when they use the music commands for simplicity.
 
 from _datetime import timedelta
+from typing import Optional
 
 from discord import Embed
 from .song import PlaylistRequest
+from .admission import QueueUsage
+from .queue_stats import QueueStats
+from .tracing import Trace
+from .track_list import TrackListSummary
 from .music_downloader import Song
 
 from config import *
@@ -14,6 +19,19 @@ PLAY_DESCRIPTION = (
     "**Usage**: `!play <YouTube URL or search query>`"
 )
 
+PLAY_EXACT_DESCRIPTION = (
+    "Same as `!play`, but always searches YouTube for the query, "
+    "instead of playing a previously played song with a similar title.\n"
+    "**Usage**: `!playexact <search query>`"
+)
+
+PLAY_FILE_DESCRIPTION = (
+    "Add all songs from an attached text or CSV file to the queue. Every line is a YouTube URL or a search query, "
+    f"CSV columns such as `artist,title` are joined into one query. Up to {PLAYFILE_MAX_ENTRIES} songs are loaded, "
+    "repeated entries are skipped.\n"
+    "**Usage**: `!playfile` with the file attached to the message"
+)
+
 SKIP_DESCRIPTION = (
     "Skip the currently playing song and move to the next one in the queue.\n"
     "**Usage**: `!skip`"
@@ -39,6 +57,12 @@ LOOP_DESCRIPTION = (
     "**Usage**: `!loop` to turn looping on or off."
 )
 
+AUTOPLAY_DESCRIPTION = (
+    "Toggle autoplay. When enabled and the queue runs out, the bot keeps playing songs related to the previous one, "
+    "picked from what is often played together or from YouTube's related videos.\n"
+    "**Usage**: `!autoplay` to turn autoplay on or off."
+)
+
 QUEUE_DESCRIPTION = (
     "Display the current list of songs in the queue.\n"
     "**Usage**: `!queue`"
@@ -54,16 +78,67 @@ SHUFFLE_DESCRIPTION = (
     "**Usage**: `!shuffle`"
 )
 
-def added_to_queue(song: Song, queue_elements: int) -> Embed:
+SEEK_DESCRIPTION = (
+    "Jump to the given position of the currently playing song.\n"
+    "**Usage**: `!seek <position>`, *e.g.* `!seek 1:30` or `!seek 90`"
+)
+
+FORWARD_DESCRIPTION = (
+    f"Fast forward the currently playing song by the given number of seconds (default {SEEK_STEP}).\n"
+    "**Usage**: `!forward [seconds]`"
+)
+
+REWIND_DESCRIPTION = (
+    f"Rewind the currently playing song by the given number of seconds (default {SEEK_STEP}).\n"
+    "**Usage**: `!rewind [seconds]`"
+)
+
+TRACE_DESCRIPTION = (
+    "Show where the time went for the latest song request in this server, "
+    "from sending the command to the first audio sent to the voice channel.\n"
+    "**Usage**: `!trace last`"
+)
+
+VOLUME_DESCRIPTION = (
+    f"Change the volume of the music player (0-{int(MAX_VOLUME * 100)}%). The change is applied immediately.\n"
+    "**Usage**: `!volume <percent>` or `!volume` to display the current volume."
+)
+
+CROSSFADE_DESCRIPTION = (
+    f"Fade between consecutive songs in the queue for the given number of seconds (0-{MAX_CROSSFADE}).\n"
+    "**Usage**: `!crossfade <seconds>`, use `!crossfade 0` to disable crossfade."
+)
+
+def _eta(seconds: float, estimated: bool = False) -> str:
+    if seconds < 1:
+        return "now"
+    return f"{'~' if estimated else ''}{timedelta(seconds=int(seconds))}"
+
+
+def added_to_queue(song: Song, queue_elements: int, eta: float) -> Embed:
     message = Embed(title=" 🎶 Song Added to Queue",
                     description=f"🔗 [{song.title}]({song.url})\n",
                     color=SUCCESS_COLOR)
     message.add_field(name="Duration", value=str(timedelta(seconds=song.duration)))
     message.add_field(name="Queue Length", value=queue_elements)
+    message.add_field(name="Plays In", value=_eta(eta))
     message.set_thumbnail(url=song.thumbnail or song.url)
     return message
 
 
+def added_songs_to_queue(songs: list[Song], queue_elements: int, eta: float) -> Embed:
+    songs_list = "\n".join(f"- [{song.title}]({song.url})" for song in songs[:10])
+    songs_list += f"\n**and {len(songs) - 10} more songs**" if len(songs) > 10 else ""
+    message = Embed(title=f" 🎶 {len(songs)} Songs Added to Queue",
+                    description=songs_list,
+                    color=SUCCESS_COLOR)
+    message.add_field(name="Total Duration", value=str(timedelta(seconds=sum(song.duration for song in songs))))
+    message.add_field(name="Queue Length", value=queue_elements)
+    message.add_field(name="First Plays In", value=_eta(eta))
+    message.set_thumbnail(url=songs[0].thumbnail or songs[0].url)
+    return message
+
+
 def added_playlist_to_queue(playlist: PlaylistRequest) -> Embed:
     message = Embed(title="📋 Songs from Playlist Added to Queue",
                     description=f"🔗 [{playlist.title}]({playlist.playlist_url})\n",
@@ -76,6 +151,68 @@ def added_playlist_to_queue(playlist: PlaylistRequest) -> Embed:
     return message
 
 
+def track_list_added(summary: TrackListSummary) -> Embed:
+    message = Embed(title=f"📄 {len(summary.added)} Songs from Track List Added to Queue",
+                    description="\n".join(f"- [{song.title}]({song.url})" for song in summary.added[:10]) or
+                                "No songs could be added",
+                    color=SUCCESS_COLOR if summary.added else ERROR_COLOR)
+    message.add_field(name="Total Duration", value=str(timedelta(seconds=sum(song.duration for song in summary.added))))
+    if summary.deferred:
+        message.add_field(name="Added Later", value=summary.deferred)
+    if summary.duplicates:
+        message.add_field(name="Duplicates Skipped", value=summary.duplicates)
+    if summary.failed:
+        failed = "\n".join(f"- *\"{query}\"*: {reason}" for query, reason in summary.failed[:5])
+        failed += f"\n**and {len(summary.failed) - 5} more**" if len(summary.failed) > 5 else ""
+        message.add_field(name=f"Failed ({len(summary.failed)})", value=failed[:1024], inline=False)
+    if summary.added:
+        message.set_thumbnail(url=summary.added[0].thumbnail or summary.added[0].url)
+    if summary.queue_limit:
+        message.set_footer(text=f"{_queue_limit(summary.queue_limit)}, the rest of the track list was not loaded")
+    elif summary.truncated:
+        message.set_footer(text=f"Only the first {PLAYFILE_MAX_ENTRIES} songs of the track list were loaded")
+    return message
+
+
+def invalid_track_list(reason: str) -> Embed:
+    message = Embed(title="📄 Invalid Track List",
+                    description=reason,
+                    color=ERROR_COLOR)
+    message.set_footer(text="💡Tip: Attach a .txt or .csv file with one YouTube URL or search query per line")
+    return message
+
+
+def _queue_limit(limit: str) -> str:
+    return {
+        "guild_entries": f"The queue of this server is limited to {MAX_GUILD_QUEUE_LENGTH} songs",
+        "guild_bytes": f"The queue of this server is limited to {MAX_GUILD_QUEUE_BYTES // 1024 ** 2} MB",
+        "total_entries": "The bot is queueing too many songs across all servers",
+        "total_bytes": "The bot is queueing too many songs across all servers",
+    }[limit]
+
+
+def queue_full(limit: str) -> Embed:
+    message = Embed(title="📦 Queue Full",
+                    description=_queue_limit(limit),
+                    color=ERROR_COLOR)
+    message.set_footer(text="💡Tip: Wait until some songs are played or use !clear")
+    return message
+
+
+def playlist_truncated(playlist: PlaylistRequest, limit: str) -> Embed:
+    message = Embed(title="📋 Songs from Playlist Partially Added to Queue",
+                    description=f"🔗 [{playlist.title}]({playlist.playlist_url})\n\n"
+                                f"Only {len(playlist.songs)} of {playlist.length} songs were added. {_queue_limit(limit)}",
+                    color=ERROR_COLOR)
+    message.set_thumbnail(url=playlist.thumbnail)
+    return message
+
+
+def queue_usage(usage: QueueUsage) -> str:
+    return (f"{usage.entries}/{MAX_GUILD_QUEUE_LENGTH} songs, "
+            f"{usage.bytes / 1024 ** 2:.1f}/{MAX_GUILD_QUEUE_BYTES / 1024 ** 2:.0f} MB")
+
+
 def download_error(query: str) -> Embed:
     return Embed(title="⛔ Download Error",
                  description=f"An error occurred while downloading the song: {query}.",
@@ -126,15 +263,20 @@ def stopped() -> Embed:
                  color=SUCCESS_COLOR)
 
 
-def queue(now_playing: Song, coming_next: list[str], looping_enabled: bool) -> Embed:
+def queue(now_playing: Song, coming_next: list[str], looping_enabled: bool, usage: QueueUsage,
+          stats: QueueStats) -> Embed:
     if now_playing or coming_next:
         now_playing = f"**Now Playing**: [{now_playing.title}]({now_playing.url})" if now_playing else "waiting..."
         message = Embed(title="🎵 Music Queue",
                         description=now_playing,
                         color=SUCCESS_COLOR)
-        waiting_in_queue = "- " + "\n- ".join(coming_next[:10]) if coming_next else "No songs in queue"
-        waiting_in_queue += f"\n**{len(coming_next)} more songs in queue**" if len(coming_next) > 10 else ""
+        waiting_in_queue = "\n".join(f"- {title} (in {_eta(eta, stats.estimated)})"
+                                     for title, eta in zip(coming_next, stats.etas)) or "No songs in queue"
+        more_songs = stats.length - len(coming_next)
+        waiting_in_queue += f"\n**{more_songs} more songs in queue**" if more_songs > 0 else ""
         message.add_field(name="Coming Next:", value=waiting_in_queue)
+        message.add_field(name="Total Duration", value=_eta(stats.duration, stats.estimated))
+        message.add_field(name="Queue Usage", value=queue_usage(usage), inline=False)
     else:
         message = Embed(title="🎵 Music Queue",
                         description="No songs in queue",
@@ -169,6 +311,23 @@ def looping(looping_enabled: bool) -> Embed:
                  color=SUCCESS_COLOR)
 
 
+def autoplay(autoplay_enabled: bool) -> Embed:
+    description = f"**Status**: {'enabled' if autoplay_enabled else 'disabled'}"
+    return Embed(title=f"📻 Autoplay",
+                 description=description,
+                 color=SUCCESS_COLOR)
+
+
+def autoplaying(song: Song) -> Embed:
+    message = Embed(title="📻 Autoplaying",
+                    description=f"🔗 [{song.title}]({song.url})\n",
+                    color=INFO_COLOR)
+    message.add_field(name="Duration", value=str(timedelta(seconds=song.duration)))
+    message.set_thumbnail(url=song.thumbnail or song.url)
+    message.set_footer(text="💡Tip: Use !autoplay to turn autoplay off")
+    return message
+
+
 def not_in_same_voice_channel(bot_channel: str) -> Embed:
     return Embed(title="⛔ Not in the Same Voice Channel",
                  description=f"You must be in the same voice channel as the bot: **{bot_channel}**",
@@ -179,3 +338,64 @@ def shuffled() -> Embed:
     return Embed(title="🔀 Queue Shuffled",
                  description="The queue has been shuffled",
                  color=SUCCESS_COLOR)
+
+
+def seeked(song: Song, position: float) -> Embed:
+    return Embed(title="⏩ Position Changed",
+                 description=f"Song: [{song.title}]({song.url})\n"
+                             f"**Position**: {timedelta(seconds=int(position))} / {timedelta(seconds=song.duration)}",
+                 color=SUCCESS_COLOR)
+
+
+def invalid_position(position: str) -> Embed:
+    message = Embed(title="⛔ Invalid Position",
+                    description=f"Could not understand the position: *\"{position}\"*",
+                    color=ERROR_COLOR)
+    message.set_footer(text="💡Tip: Use seconds or minutes and seconds, e.g. 90 or 1:30")
+    return message
+
+
+def volume(volume_level: float) -> Embed:
+    return Embed(title="🔊 Volume",
+                 description=f"**Volume**: {round(volume_level * 100)}%",
+                 color=SUCCESS_COLOR)
+
+
+def crossfade(seconds: int) -> Embed:
+    description = f"**Crossfade**: {f'{seconds} seconds' if seconds else 'disabled'}"
+    return Embed(title="🎚️ Crossfade",
+                 description=description,
+                 color=SUCCESS_COLOR)
+
+
+def invalid_value(name: str, minimum: int, maximum: int) -> Embed:
+    return Embed(title="⛔ Invalid Value",
+                 description=f"The {name} must be between {minimum} and {maximum}",
+                 color=ERROR_COLOR)
+
+
+def queue_restored(now_playing: Optional[Song], queue_length: int) -> Embed:
+    message = Embed(title="♻️ Queue Restored",
+                    description=f"**Now Playing**: [{now_playing.title}]({now_playing.url})" if now_playing else None,
+                    color=SUCCESS_COLOR)
+    message.add_field(name="Queue Length", value=queue_length)
+    message.set_footer(text="The bot has been restarted, the queue was restored")
+    return message
+
+
+def trace_breakdown(trace: Trace) -> Embed:
+    lines = [f"`{start * 1000:7.0f} ms` **{name}** ({(end - start) * 1000:.0f} ms)" for name, start, end in trace.spans]
+    message = Embed(title="⏱️ Request Trace",
+                    description=f"**Query**: {trace.query}\n\n" + "\n".join(lines),
+                    color=ERROR_COLOR if trace.error else INFO_COLOR)
+    message.add_field(name="Total", value=f"{trace.duration * 1000:.0f} ms")
+    if trace.error:
+        message.add_field(name="Error", value=trace.error)
+    message.set_footer(text=f"Trace ID: {trace.trace_id}")
+    return message
+
+
+def no_trace() -> Embed:
+    return Embed(title="⏱️ No Trace",
+                 description="No song request has finished in this server yet",
+                 color=INFO_COLOR)
@@ -1,29 +1,185 @@
+import asyncio
+import contextlib
+import logging
+from time import time
+from typing import Callable, Optional
+
+import aiohttp
 import discord
+from cachetools import TTLCache
 from discord.ext import commands, tasks
 
 from cogs.music.messages import *
 from cogs.music.music_service import MusicPlayer
 from cogs.music.song_queue import BgDownloadSongQueue
+from cogs.music.admission import QueueAdmission, queue_admission
 from cogs.music.song_cache import LRUSongsCache
-from cogs.music.music_downloader import SongDownloader
+from cogs.music.search_index import SongSearchIndex
+from cogs.music.tracing import Trace, TraceSink
+from cogs.music.ffmpeg_supervisor import ffmpeg_supervisor
+from cogs.music.audio_monitor import playback_monitor
+from cogs.music.music_downloader import SongDownloader, DownloaderException, ThrottledException
+from cogs.music.message_batcher import MessageBatcher
+from cogs.music.queue_state import PlayerState, QueueStateStore
+from cogs.music.radio import PlayHistoryIndex, Radio
+from cogs.music.track_list import TrackListLoader, TrackListReader, TrackListSummary, TrackResult
 from config import *
-from .song import SongRequest
+from .song import Song, SongRequest
 
 class MusicCog(commands.Cog):
 
     def __init__(self, bot: commands.Bot) -> None:
         self._bot = bot
         self._servers_music_players: dict[int, MusicPlayer] = {}  # guild_id: MusicPlayer
-        self._song_downloader = SongDownloader(LRUSongsCache(CACHE_SIZE, QUERIES_CACHE_SIZE))
+        self._song_downloader = SongDownloader(LRUSongsCache(CACHE_SIZE, QUERIES_CACHE_SIZE),
+                                               SongSearchIndex(SEARCH_INDEX_SIZE, SEARCH_INDEX_CONFIDENCE,
+                                                               SEARCH_INDEX_MIN_COVERAGE))
+        self._message_batcher = MessageBatcher(MESSAGE_BATCH_WINDOW)
+        self._track_list_loader = TrackListLoader(self._song_downloader, PLAYFILE_BATCH_SIZE,
+                                                  PLAYFILE_CONCURRENT_BATCHES)
+        self._radio = Radio(PlayHistoryIndex(RADIO_HISTORY_SIZE, RADIO_HISTORY_WINDOW, RADIO_RECENT_SIZE),
+                            self._song_downloader, RADIO_MAX_ATTEMPTS)
+        self._queue_state = QueueStateStore(QUEUE_STATE_DIR)
+        self._snapshot_versions: dict[int, tuple[int, float]] = {}  # guild_id: (player version, time) of the snapshot
+        self._traces = TraceSink(TRACES_PATH, TRACES_MAX_BYTES, TRACES_BACKUP_COUNT)
+        self._command_traces: TTLCache[int, Trace] = TTLCache(maxsize=1000, ttl=60)  # message_id: trace
 
         self.monitor_music_player_status.start()
         self.check_listeners.start()
+        self.snapshot_queues.start()
+        self.supervise_ffmpeg.start()
+        self.monitor_playback.start()
+
+    async def warm_up(self) -> None:
+        await asyncio.to_thread(self._song_downloader.warm_up)
+
+    async def cog_unload(self) -> None:
+        # cogs are removed when the bot is closing, before it disconnects from the voice channels
+        self.monitor_music_player_status.cancel()
+        self.check_listeners.cancel()
+        self.supervise_ffmpeg.cancel()
+        self.monitor_playback.cancel()
+        self.snapshot_queues.cancel()
+        await self.snapshot_queues(force=True)
+
+    async def restore_players(self) -> None:
+        """
+        Reconnects to the voice channels and restores the queues saved before the bot was restarted.
+        """
+        states = await asyncio.to_thread(self._queue_state.load_all)
+        for guild_id, state in states.items():
+            try:
+                await self._restore_player(guild_id, state)
+            except (discord.ClientException, asyncio.TimeoutError) as e:
+                logging.warning(f"Failed to restore the queue of guild {guild_id}: {e}")
+                await asyncio.to_thread(self._queue_state.delete, guild_id)
+            except Exception as e:  # the queues of the other guilds are still restored
+                logging.error(f"Failed to restore the queue of guild {guild_id}: {e}", exc_info=True)
+                if guild_id in self._servers_music_players:  # disconnects from the voice channel
+                    await self._stop_music_player(guild_id)
+                else:
+                    await asyncio.to_thread(self._queue_state.delete, guild_id)
+
+    async def _restore_player(self, guild_id: int, state: PlayerState) -> None:
+        voice_channel = self._bot.get_channel(state.voice_channel_id)
+        text_channel = self._bot.get_channel(state.text_channel_id)
+        if not voice_channel or not text_channel or all(member.bot for member in voice_channel.members):
+            await asyncio.to_thread(self._queue_state.delete, guild_id)
+            return
+        voice_client = await voice_channel.connect()
+        music_player = MusicPlayer(voice_client, self._create_song_queue(guild_id), self._song_downloader,
+                                   self._message_batcher, queue_admission, self._radio)
+        self._servers_music_players[guild_id] = music_player
+        music_player.restore(state, text_channel)
+        self._message_batcher.send(text_channel, queue_restored(music_player.now_playing,
+                                                                await music_player.queue_length()))
+        logging.info(f"Restored the queue of guild {guild_id}")
+
+    def _create_song_queue(self, guild_id: int) -> BgDownloadSongQueue:
+        return BgDownloadSongQueue(self._song_downloader, self._message_batcher, queue_admission, guild_id)
 
     @commands.command(description=PLAY_DESCRIPTION)
     async def play(self, ctx: commands.Context, *, search: str) -> None:
+        song_request = SongRequest(search, ctx.channel, ctx.guild, trace=self._request_trace(ctx, search))
+        await self._play(ctx, song_request)
+
+    @commands.command(description=PLAY_EXACT_DESCRIPTION)
+    async def playexact(self, ctx: commands.Context, *, search: str) -> None:
+        song_request = SongRequest(search, ctx.channel, ctx.guild, exact=True, trace=self._request_trace(ctx, search))
+        await self._play(ctx, song_request)
+
+    async def _play(self, ctx: commands.Context, song_request: SongRequest) -> None:
         music_player = self._servers_music_players[ctx.guild.id]
-        song_request = SongRequest(search, ctx)
-        await music_player.play(song_request)
+        try:
+            await music_player.play(song_request)
+        except QueueAdmission.LimitReached as e:
+            song_request.trace.finish(type(e).__name__)
+            await ctx.send(embed=queue_full(e.limit))
+
+    @commands.command(description=PLAY_FILE_DESCRIPTION)
+    async def playfile(self, ctx: commands.Context) -> None:
+        music_player = self._servers_music_players[ctx.guild.id]
+        attachment = next(iter(ctx.message.attachments), None)
+        if not attachment:
+            await ctx.send(embed=invalid_track_list("Attach the track list to the message"))
+            return
+        if attachment.size > PLAYFILE_MAX_BYTES:
+            await ctx.send(embed=invalid_track_list(f"The track list is larger than {PLAYFILE_MAX_BYTES // 1024} KB"))
+            return
+
+        summary = TrackListSummary()
+        reader = TrackListReader(attachment, PLAYFILE_MAX_ENTRIES, summary)
+        try:
+            # closed on return, so the download and the batches still being resolved end with the command
+            async with ctx.typing(), contextlib.aclosing(reader.queries()) as queries, contextlib.aclosing(
+                    self._track_list_loader.load(queries, ctx.voice_client.channel.bitrate)) as batches:
+                async for results in batches:
+                    if self._servers_music_players.get(ctx.guild.id) is not music_player:  # stopped while loading
+                        return
+                    try:
+                        await self._add_track_results(ctx, music_player, results, summary)
+                    except QueueAdmission.LimitReached as e:  # the rest of the list is not read at all
+                        summary.queue_limit = e.limit
+                        break
+        except (aiohttp.ClientError, ValueError) as e:  # ValueError is raised for too long lines
+            logging.warning(f"Failed to read track list {attachment.filename}: {e}")
+            await ctx.send(embed=invalid_track_list("The track list could not be read"))
+            return
+        await ctx.send(embed=track_list_added(summary))
+
+    @staticmethod
+    async def _add_track_results(ctx: commands.Context, music_player: MusicPlayer, results: list[TrackResult],
+                                 summary: TrackListSummary) -> None:
+        added_urls = {song.url for song in summary.added}
+        songs = []
+        throttled = []  # (query, error) resolved by the queue once YouTube stops throttling
+        for query, result in results:
+            if isinstance(result, Song):  # different queries of the list may resolve to the same song
+                if result.url in added_urls:
+                    summary.duplicates += 1
+                else:
+                    added_urls.add(result.url)
+                    songs.append(result)
+            elif isinstance(result, ThrottledException):
+                throttled.append((query, result))
+            elif isinstance(result, DownloaderException):
+                summary.failed.append((query, result.embed(query).title.strip()))
+            elif isinstance(result, Exception):
+                summary.failed.append((query, download_error(query).title))
+        try:
+            await music_player.add_songs(songs, ctx.channel)
+        except QueueAdmission.LimitReached as e:
+            summary.added.extend(songs[:e.admitted])
+            summary.failed.extend((query, error.embed(query).title.strip()) for query, error in throttled)
+            raise
+        summary.added.extend(songs)
+        for i, (query, error) in enumerate(throttled):
+            try:
+                await music_player.play(SongRequest(query, ctx.channel, ctx.guild, quiet=True))
+            except QueueAdmission.LimitReached:
+                summary.failed.extend((query, error.embed(query).title.strip()) for query, error in throttled[i:])
+                raise
+            summary.deferred += 1
 
     @commands.command(description=SKIP_DESCRIPTION)
     async def skip(self, ctx: commands.Context) -> None:
@@ -63,11 +219,18 @@ class MusicCog(commands.Cog):
         music_player.loop = not music_player.loop
         await ctx.send(embed=looping(music_player.loop))
 
+    @commands.command(description=AUTOPLAY_DESCRIPTION)
+    async def autoplay(self, ctx: commands.Context) -> None:
+        music_player = self._servers_music_players[ctx.guild.id]
+        music_player.autoplay = not music_player.autoplay
+        await ctx.send(embed=autoplay(music_player.autoplay))
+
     @commands.command(description=QUEUE_DESCRIPTION)
     async def queue(self, ctx: commands.Context) -> None:
         music_player = self._servers_music_players[ctx.guild.id]
         now_playing, waiting = await music_player.get_queue_info()
-        await ctx.send(embed=queue(now_playing, waiting, music_player.loop))
+        await ctx.send(embed=queue(now_playing, waiting, music_player.loop, queue_admission.usage(ctx.guild.id),
+                                   await music_player.queue_stats()))
 
     @commands.command(description=CLEAR_DESCRIPTION)
     async def clear(self, ctx: commands.Context) -> None:
@@ -81,6 +244,79 @@ class MusicCog(commands.Cog):
         await music_player.shuffle()
         await ctx.send(embed=shuffled())
 
+    @commands.command(description=SEEK_DESCRIPTION)
+    async def seek(self, ctx: commands.Context, position: str) -> None:
+        try:
+            seconds = self._parse_position(position)
+        except ValueError:
+            await ctx.send(embed=invalid_position(position))
+            return
+        await self._seek(ctx, lambda _: seconds)
+
+    @commands.command(description=FORWARD_DESCRIPTION)
+    async def forward(self, ctx: commands.Context, seconds: int = SEEK_STEP) -> None:
+        await self._seek(ctx, lambda current: current + seconds)
+
+    @commands.command(description=REWIND_DESCRIPTION)
+    async def rewind(self, ctx: commands.Context, seconds: int = SEEK_STEP) -> None:
+        await self._seek(ctx, lambda current: current - seconds)
+
+    @commands.command(description=VOLUME_DESCRIPTION)
+    async def volume(self, ctx: commands.Context, percent: Optional[int] = None) -> None:
+        music_player = self._servers_music_players[ctx.guild.id]
+        if percent is not None:
+            if not 0 <= percent <= MAX_VOLUME * 100:
+                await ctx.send(embed=invalid_value("volume", 0, int(MAX_VOLUME * 100)))
+                return
+            music_player.volume = percent / 100
+        await ctx.send(embed=volume(music_player.volume))
+
+    @commands.command(description=CROSSFADE_DESCRIPTION)
+    async def crossfade(self, ctx: commands.Context, seconds: int) -> None:
+        music_player = self._servers_music_players[ctx.guild.id]
+        if not 0 <= seconds <= MAX_CROSSFADE:
+            await ctx.send(embed=invalid_value("crossfade", 0, MAX_CROSSFADE))
+            return
+        music_player.crossfade = seconds
+        await ctx.send(embed=crossfade(seconds))
+
+    async def _seek(self, ctx: commands.Context, get_position: Callable[[float], float]) -> None:
+        music_player = self._servers_music_players[ctx.guild.id]
+        try:
+            await music_player.seek(get_position(music_player.position))
+            await ctx.send(embed=seeked(music_player.now_playing, music_player.position))
+        except MusicPlayer.NotPlayingException:
+            await ctx.send(embed=not_playing())
+
+    @staticmethod
+    def _parse_position(position: str) -> int:
+        # accepts seconds, mm:ss and hh:mm:ss
+        parts = [int(part) for part in position.split(":")]
+        if len(parts) > 3 or any(part < 0 for part in parts):
+            raise ValueError(position)
+        seconds = 0
+        for part in parts:
+            seconds = seconds * 60 + part
+        return seconds
+
+    @commands.command(description=TRACE_DESCRIPTION)
+    async def trace(self, ctx: commands.Context, which: str = "last") -> None:
+        if which != "last":
+            raise commands.BadArgument(f"Unknown trace: {which}")
+        last_trace = self._traces.last(ctx.guild.id)
+        await ctx.send(embed=trace_breakdown(last_trace) if last_trace else no_trace())
+
+    def _request_trace(self, ctx: commands.Context, query: str) -> Trace:
+        trace = self._command_traces.pop(ctx.message.id, None) or self._start_trace(ctx)
+        trace.query = query
+        trace.mark("queued")
+        return trace
+
+    def _start_trace(self, ctx: commands.Context) -> Trace:
+        trace = self._traces.start(ctx.guild.id, ctx.message.content, ctx.message.created_at.timestamp())
+        trace.add_span("command received", trace.started_at, time())
+        return trace
+
     async def _stop_music_player(self, guild_id: int) -> None:
         try:
             music_player = self._servers_music_players[guild_id]
@@ -88,6 +324,8 @@ class MusicCog(commands.Cog):
             return
         await music_player.stop()
         self._servers_music_players.pop(guild_id, None)
+        self._snapshot_versions.pop(guild_id, None)
+        await asyncio.to_thread(self._queue_state.delete, guild_id)
 
     @staticmethod
     async def _is_on_same_channel(ctx: commands.Context) -> None:
@@ -115,15 +353,54 @@ class MusicCog(commands.Cog):
             if not music_player.now_playing and not await music_player.queue_length():
                 await self._stop_music_player(guild_id)
 
+    @tasks.loop(seconds=FFMPEG_CHECK_INTERVAL)
+    async def supervise_ffmpeg(self) -> None:
+        ffmpeg_supervisor.check({guild_id for guild_id, music_player in self._servers_music_players.items()
+                                 if music_player.paused})
+
+    @tasks.loop(seconds=PLAYBACK_CHECK_INTERVAL)
+    async def monitor_playback(self) -> None:
+        playback_monitor.check()
+
+    @tasks.loop(seconds=QUEUE_SNAPSHOT_INTERVAL)
+    async def snapshot_queues(self, force: bool = False) -> None:
+        # only the players that changed are serialized, the position in the playing song is saved less often
+        now = time()
+        states = {}
+        for guild_id, music_player in self._servers_music_players.items():
+            version, saved_at = self._snapshot_versions.get(guild_id, (None, 0.0))
+            if force or music_player.version != version or \
+                    (music_player.now_playing and now - saved_at >= QUEUE_SNAPSHOT_POSITION_INTERVAL):
+                states[guild_id] = music_player.snapshot()
+                self._snapshot_versions[guild_id] = (music_player.version, now)
+        if states:
+            await asyncio.to_thread(self._save_queue_states, states)
+
+    def _save_queue_states(self, states: dict[int, Optional[PlayerState]]) -> None:
+        for guild_id, state in states.items():
+            if state:
+                self._queue_state.save(guild_id, state)
+            if guild_id not in self._servers_music_players:  # player stopped while saving
+                self._queue_state.delete(guild_id)
+
     @play.before_invoke
+    @playexact.before_invoke
+    @playfile.before_invoke
     async def connect_on_command(self, ctx: commands.Context) -> None:
         if ctx.author.voice is None:
             await ctx.send(embed=not_in_voice_channel())
             raise commands.CommandError("User not connected to a voice channel.")
+        # the trace is picked up by the command, unused traces of failed commands expire
+        trace = self._command_traces[ctx.message.id] = self._start_trace(ctx)
         if ctx.voice_client is None:
-            voice_client = await ctx.author.voice.channel.connect()
+            with trace.span("voice connect"):
+                voice_client = await ctx.author.voice.channel.connect()
             self._servers_music_players[ctx.guild.id] = MusicPlayer(voice_client,
-                                                                    BgDownloadSongQueue(self._song_downloader))
+                                                                    self._create_song_queue(ctx.guild.id),
+                                                                    self._song_downloader,
+                                                                    self._message_batcher,
+                                                                    queue_admission,
+                                                                    self._radio)
         await self._is_on_same_channel(ctx)
 
     @skip.before_invoke
@@ -131,8 +408,15 @@ class MusicCog(commands.Cog):
     @pause.before_invoke
     @resume.before_invoke
     @loop.before_invoke
+    @autoplay.before_invoke
     @clear.before_invoke
+    @shuffle.before_invoke
     @queue.before_invoke
+    @seek.before_invoke
+    @forward.before_invoke
+    @rewind.before_invoke
+    @volume.before_invoke
+    @crossfade.before_invoke
     async def ensure_bot_on_voice(self, ctx: commands.Context) -> None:
         if ctx.guild.id not in self._servers_music_players:
             await ctx.send(embed=not_connected())
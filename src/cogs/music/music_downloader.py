@@ -1,37 +1,81 @@
 import asyncio
 import re
 import logging
-from typing import Optional
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar, Union
 
+import requests
 from youtube_search import YoutubeSearch
 
 import yt_dlp
+from .search_index import SongSearchIndex
 from .song_cache import SongsCache
+from .throttle import ExtractionThrottle
+from .tracing import Trace, span
 from .song import Song, SongRequest, PlaylistRequest
 from abc import ABC, abstractmethod
 from discord import Embed
 from config import *
 
+T = TypeVar("T")
+
 
 class YtDlpLogger:
     """
     Custom logger for yt-dlp, because the default logger is too verbose.
     Since yd-dlp uses debug, info, warning, and error, it can be overridden.
+    Messages below YT_DLP_LOG_LEVEL are dropped before any formatting is done.
     """
 
-    _LOG_PREFIX = "yt-dlp: "
+    _logger = logging.getLogger("yt-dlp")
+    _logger.setLevel(YT_DLP_LOG_LEVEL)
 
     def debug(self, msg):
-        logging.debug(f"{self._LOG_PREFIX}{msg}")
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("%s", msg)
 
     def info(self, msg):
-        logging.info(f"{self._LOG_PREFIX}{msg}")
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info("%s", msg)
 
     def warning(self, msg):
-        logging.warning(f"{self._LOG_PREFIX}{msg}")
+        self._logger.warning("%s", msg)
 
     def error(self, msg):
-        logging.error(f"{self._LOG_PREFIX}{msg}")
+        self._logger.error("%s", msg)
+
+
+class SingleRequestYoutubeSearch(YoutubeSearch):
+    """
+    YoutubeSearch keeps repeating the request until YouTube answers with search results,
+    which hammers YouTube while the bot is being throttled. This version makes a single request
+    and raises an error instead, so it can be handled by the throttle.
+    """
+
+    def _search(self) -> list[dict]:
+        url = f"https://youtube.com/results?search_query={urllib.parse.quote_plus(self.search_terms)}"
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        if "ytInitialData" not in response.text:
+            raise ExtractionThrottle.SearchThrottledError(response.status_code)
+        results = self._parse_html(response.text)
+        return results[:self.max_results] if self.max_results is not None else results
+
+
+# shared by all requests made to YouTube, so that throttling in one guild slows down all of them
+youtube_throttle = ExtractionThrottle(rate=YOUTUBE_REQUESTS_PER_SECOND,
+                                      capacity=YOUTUBE_REQUESTS_BURST,
+                                      failure_threshold=THROTTLE_FAILURE_THRESHOLD,
+                                      base_backoff=THROTTLE_BASE_BACKOFF,
+                                      max_backoff=THROTTLE_MAX_BACKOFF)
+# runs everything that goes through the throttle, so the threads waiting for it don't fill the default executor,
+# which is needed by the other commands, e.g. !stop deleting the queue snapshot
+youtube_executor = ThreadPoolExecutor(max_workers=YOUTUBE_WORKERS, thread_name_prefix="youtube")
+
+
+async def _run_on_youtube_executor(func: Callable[..., T], *args) -> T:
+    return await asyncio.get_running_loop().run_in_executor(youtube_executor, func, *args)
 
 
 class SongDownloader:
@@ -43,14 +87,15 @@ class SongDownloader:
     )
     _yt_dlp_opts = {
         'format': 'bestaudio/best',
-        'quiet': False,
+        'quiet': True,
         'match_filter': '!is_live',
         'logger': YtDlpLogger(),
     }
 
-    def __init__(self, song_cache: SongsCache):
+    def __init__(self, song_cache: SongsCache, search_index: SongSearchIndex):
         self._load_cookies(COOKIES_PATH)  # cookies are required to be able to download age-restricted songs
         self._song_cache: SongsCache = song_cache
+        self._search_index = search_index
 
     def _load_cookies(self, cookies_path: Path) -> None:
         if cookies_path.exists():
@@ -61,24 +106,142 @@ class SongDownloader:
                          "Create a cookies.txt file in the root directory for age-restricted songs. "
                          "See README.md for details.")
 
-    async def prepare_song(self, query: str) -> Song:
-        if query in self._song_cache:
-            return self._song_cache[query]
-        song = await asyncio.to_thread(self._construct_song, query)
-        self._song_cache[query] = song
+    def warm_up(self) -> None:
+        """
+        yt-dlp initializes its extractors and loads the cookies on the first extraction,
+        it is done here, so the first song request does not have to wait for it.
+        """
+        with yt_dlp.YoutubeDL(self._yt_dlp_opts) as ydl:
+            ydl.get_info_extractor("Youtube")
+            _ = ydl.cookiejar
+
+    async def prepare_song(self, query: str, bitrate: Optional[int] = None, exact: bool = False,
+                           trace: Optional[Trace] = None) -> Song:
+        """
+        :param bitrate: bitrate of the target voice channel in bps, the smallest audio format meeting it is selected
+        :param exact: whether to always search YouTube, instead of using the song with the closest known title
+        """
+        tier = self._bitrate_tier(bitrate)
+        if (query, tier) in self._song_cache:
+            return self._song_cache[query, tier]
+        if not exact and not self._youtube_regex.match(query):
+            indexed_url = self._search_index.find(query)
+            if indexed_url:
+                logging.debug(f"Query {query} matched a known song {indexed_url}")
+                return await self.prepare_song(indexed_url, bitrate, exact=True, trace=trace)
+        song = await _run_on_youtube_executor(self._construct_song, query, tier, trace)
+        self._song_cache[query, tier] = song
+        self._search_index.add(song)
         return song
 
-    def _construct_song(self, query: str) -> Song:
-        url = self._get_url(query)
-        if url in self._song_cache:
-            return self._song_cache[url]
-        with yt_dlp.YoutubeDL(self._yt_dlp_opts) as ydl:
+    async def refresh_song(self, song: Song, bitrate: Optional[int] = None) -> Song:
+        """
+        Extracts a new stream URL of the song, e.g. after its stream failed.
+        The cache is bypassed, because it may hold the same dead stream URL.
+        """
+        tier = self._bitrate_tier(bitrate)
+        refreshed = await _run_on_youtube_executor(self._refresh_song, song.url, tier)
+        self._song_cache[song.url, tier] = refreshed
+        return refreshed
+
+    async def prepare_songs(self, queries: list[str], bitrate: Optional[int] = None) -> list[Union[Song, Exception]]:
+        """
+        Resolves many queries at once, e.g. a track list. Songs in the cache or the search index are not resolved again,
+        the rest are resolved in a single thread by one yt-dlp instance.
+        Returns the song or the error for every query, in the same order.
+        """
+        tier = self._bitrate_tier(bitrate)
+        results: list[Union[Song, Exception, None]] = [None] * len(queries)
+        missing = []  # (index, query) of the songs to resolve
+        for i, query in enumerate(queries):
+            if (query, tier) not in self._song_cache and not self._youtube_regex.match(query):
+                query = self._search_index.find(query) or query
+            if (query, tier) in self._song_cache:
+                results[i] = self._song_cache[query, tier]
+            else:
+                missing.append((i, query))
+        if missing:
+            resolved = await _run_on_youtube_executor(self._construct_songs,
+                                                      [query for _, query in missing], tier)
+            for (i, query), result in zip(missing, resolved):
+                if isinstance(result, Song):
+                    self._song_cache[query, tier] = result
+                    self._search_index.add(result)
+                results[i] = result
+        return results
+
+    async def related_urls(self, url: str) -> list[str]:
+        """
+        Returns URLs of the videos YouTube considers related to the given one, taken from its mix.
+        """
+        match = self._youtube_regex.match(url)
+        if not match:
+            return []
+        return await _run_on_youtube_executor(self._extract_related_urls, match.group(1))
+
+    def _extract_related_urls(self, video_id: str) -> list[str]:
+        opts = {**self._yt_dlp_opts, 'extract_flat': True, 'playlistend': RADIO_RELATED_LIMIT}
+        with yt_dlp.YoutubeDL(opts) as ydl:
             try:
-                info = ydl.extract_info(url, download=False)
-            except yt_dlp.utils.DownloadError as e:
-                if "Sign in to confirm your age" in str(e):
-                    raise AgeRestrictedException(query)
-                raise NoResultsFoundException(query)
+                info = youtube_throttle.call(ydl.extract_info,
+                                             f"https://www.youtube.com/watch?v={video_id}&list=RD{video_id}",
+                                             download=False)
+            except ExtractionThrottle.Throttled as e:
+                raise ThrottledException(video_id, e.retry_after)
+            except yt_dlp.utils.DownloadError:
+                raise NoResultsFoundException(video_id)
+        return [f"https://www.youtube.com/watch?v={entry['id']}" for entry in info.get('entries') or []
+                if entry and entry.get('id') != video_id and (entry.get('duration') or 0) <= RADIO_MAX_DURATION
+                and entry.get('live_status') != 'is_live']
+
+    @staticmethod
+    def _bitrate_tier(bitrate: Optional[int]) -> int:
+        if bitrate is None:
+            return AUDIO_BITRATE_TIERS[-1]
+        return next((tier for tier in AUDIO_BITRATE_TIERS if tier * 1000 >= bitrate), AUDIO_BITRATE_TIERS[-1])
+
+    def _construct_songs(self, queries: list[str], tier: int) -> list[Union[Song, Exception]]:
+        results: list[Union[Song, Exception]] = []
+        with yt_dlp.YoutubeDL(self._extraction_opts(tier)) as ydl:  # shared, so the extractors are set up once
+            for query in queries:
+                try:
+                    results.append(self._construct_song(query, tier, None, ydl))
+                except Exception as e:
+                    if not isinstance(e, DownloaderException):
+                        logging.error(e, exc_info=True)
+                    results.append(e)
+        return results
+
+    def _refresh_song(self, url: str, tier: int) -> Song:
+        with yt_dlp.YoutubeDL(self._extraction_opts(tier)) as ydl:
+            return self._extract_song(ydl, url, url, None)
+
+    def _extraction_opts(self, tier: int) -> dict:
+        # discord re-encodes the audio to the channel bitrate, so anything above it is wasted bandwidth and CPU
+        return {**self._yt_dlp_opts, 'format': f'worstaudio[abr>={tier}]/bestaudio/best'}
+
+    def _construct_song(self, query: str, tier: int, trace: Optional[Trace],
+                        ydl: Optional[yt_dlp.YoutubeDL] = None) -> Song:
+        with span(trace, "search"):
+            url = self._get_url(query)
+        if (url, tier) in self._song_cache:
+            return self._song_cache[url, tier]
+        if ydl is None:
+            with yt_dlp.YoutubeDL(self._extraction_opts(tier)) as ydl:
+                return self._extract_song(ydl, query, url, trace)
+        return self._extract_song(ydl, query, url, trace)
+
+    @staticmethod
+    def _extract_song(ydl: yt_dlp.YoutubeDL, query: str, url: str, trace: Optional[Trace]) -> Song:
+        try:
+            with span(trace, "extraction"):
+                info = youtube_throttle.call(ydl.extract_info, url, download=False)
+        except ExtractionThrottle.Throttled as e:
+            raise ThrottledException(query, e.retry_after)
+        except yt_dlp.utils.DownloadError as e:
+            if "Sign in to confirm your age" in str(e):
+                raise AgeRestrictedException(query)
+            raise NoResultsFoundException(query)
 
         if info.get('is_live', False):
             raise LiveFoundException(query)
@@ -98,7 +261,10 @@ class SongDownloader:
             raise PlaylistFoundException(query)
         if self._youtube_regex.match(query):
             return query
-        search = YoutubeSearch(query, max_results=1).to_dict()
+        try:
+            search = youtube_throttle.call(SingleRequestYoutubeSearch, query, max_results=1).to_dict()
+        except ExtractionThrottle.Throttled as e:
+            raise ThrottledException(query, e.retry_after)
         if not search: raise NoResultsFoundException(query)
         return f"https://www.youtube.com/watch?v={search[0]['id']}"
 
@@ -117,13 +283,7 @@ class PlaylistExtractor:
         self._playlist_url = self._get_playlist_url(url)
 
     async def get_playlist_requests(self, song_request: SongRequest) -> PlaylistRequest:
-        with yt_dlp.YoutubeDL(self._ydl_opts) as ydl:
-            try:
-                playlist_info = ydl.extract_info(self._playlist_url, download=False)
-            except yt_dlp.utils.DownloadError as e:
-                if "This playlist type is unviewable." in str(e):
-                    raise YoutubeMixFoundException(self._playlist_url)
-                raise PlaylistNotFoundError(self._playlist_url)
+        playlist_info = await _run_on_youtube_executor(self._extract_playlist_info)
 
         return PlaylistRequest(title=playlist_info['title'],
                                thumbnail=playlist_info['thumbnails'][0]['url'],
@@ -132,12 +292,24 @@ class PlaylistExtractor:
                                songs=self._get_song_requests(playlist_info['entries'], song_request),
                                playlist_url=self._playlist_url)
 
+    def _extract_playlist_info(self) -> dict:
+        with yt_dlp.YoutubeDL(self._ydl_opts) as ydl:
+            try:
+                return youtube_throttle.call(ydl.extract_info, self._playlist_url, download=False)
+            except ExtractionThrottle.Throttled as e:
+                raise ThrottledException(self._playlist_url, e.retry_after)
+            except yt_dlp.utils.DownloadError as e:
+                if "This playlist type is unviewable." in str(e):
+                    raise YoutubeMixFoundException(self._playlist_url)
+                raise PlaylistNotFoundError(self._playlist_url)
+
     @staticmethod
     def _calculate_duration(entries: list[dict]) -> int:
         return sum(video['duration'] for video in entries if video["duration"])
 
     def _get_song_requests(self, entries: list[dict], song_request: SongRequest) -> list[SongRequest]:
-        requests = [SongRequest(video['url'], song_request.ctx, quiet=True, _title=video['title']) for video in entries]
+        requests = [SongRequest(video['url'], song_request.channel, song_request.guild, quiet=True, _title=video['title'],
+                                duration=video['duration']) for video in entries]
         if self._index is not None:
             requests = requests[self._index:] + requests[:self._index]
         return requests
@@ -174,6 +346,20 @@ class NoResultsFoundException(DownloaderException):
         return message
 
 
+class ThrottledException(DownloaderException):
+    def __init__(self, query: str, retry_after: float) -> None:
+        super().__init__(query)
+        self.retry_after = retry_after
+
+    @staticmethod
+    def embed(query: str) -> Embed:
+        message = Embed(title="⏳ YouTube Is Busy",
+                        description=f"YouTube is limiting our requests, we couldn't get: *\"{query}\"*\n\n",
+                        color=ERROR_COLOR)
+        message.set_footer(text="💡Tip: Wait a few minutes and try again")
+        return message
+
+
 class LiveFoundException(DownloaderException):
     @staticmethod
     def embed(query: str) -> Embed:
@@ -1,10 +1,22 @@
 import asyncio
 import logging
-from typing import Optional
+from time import time
+from typing import Callable, Optional
 
+from .admission import QueueAdmission
+from .queue_state import PlayerState
+from .queue_stats import DurationSequence, QueueStats
+from .music_downloader import SongDownloader, DownloaderException
+from .radio import Radio
+from .tracing import span
 from .song import SongRequest
-from discord import VoiceClient
+from discord import HTTPException, VoiceClient
+from discord.abc import Messageable
 
+from .audio_mixer import AudioMixer
+from .audio_monitor import MonitoredSource, playback_monitor
+from .message_batcher import MessageBatcher
+from .ffmpeg_supervisor import ffmpeg_supervisor
 from .messages import *
 from .song_queue import SongQueue
 
@@ -14,15 +26,37 @@ class MusicPlayer:
         def __init__(self):
             super().__init__("Player is not playing")
 
-    def __init__(self, voice_client: VoiceClient, song_queue: SongQueue):
+    def __init__(self, voice_client: VoiceClient, song_queue: SongQueue, song_downloader: SongDownloader,
+                 message_batcher: MessageBatcher, admission: QueueAdmission, radio: Radio):
         self._now_playing: Optional[Song] = None
         self._voice_client = voice_client
         self._song_queue = song_queue
+        self._song_downloader = song_downloader
+        self._message_batcher = message_batcher
+        self._admission = admission  # the looped songs are counted like the queued ones
         self._loop = False
         self._processing_queue = False
         self._looped_songs: list[Song] = []
+        self._looped_durations = DurationSequence()  # durations of the looped songs, in the same order
         self._clearing_queue = False
         self._processing_task: Optional[asyncio.Task] = None
+        self._mixer: Optional[AudioMixer] = None
+        self._monitored_source: Optional[MonitoredSource] = None  # the mixer as handed to the voice client
+        self._volume = DEFAULT_VOLUME
+        self._crossfade = DEFAULT_CROSSFADE
+        self._stopping = False  # whether the current song was ended on purpose (skip, stop)
+        self._stopped = False  # whether the player was stopped, the songs ending afterwards are not looped
+        self._resume_offset: Optional[float] = None  # position to resume the current song at after a stream error
+        self._resume_attempts = 0
+        self._text_channel: Optional[Messageable] = None  # channel of the latest request
+        self._radio = radio
+        self._autoplay = False
+        self._radio_task: Optional[asyncio.Task] = None  # resolves the song autoplay plays after the current one
+        self._radio_song: Optional[Song] = None  # the latest song picked by autoplay
+        self._version = 0  # changed with everything saved by snapshot, except the position in the current song
+        self._radio_seed: Optional[Song] = None  # the latest song started, autoplay picks a song related to it
+        self._replaying = False  # whether the next song is taken from the looped songs
+        self._song_queue.set_playback_remaining(self._playback_remaining)
 
     async def pause(self) -> None:
         if not self._now_playing:
@@ -32,13 +66,42 @@ class MusicPlayer:
     async def resume(self):
         if not self._now_playing:
             raise MusicPlayer.NotPlayingException
+        if self._monitored_source:
+            self._monitored_source.restart_schedule()
         self._voice_client.resume()
 
     async def skip(self) -> None:
         if not self._now_playing:
             raise MusicPlayer.NotPlayingException
+        self._stopping = True
         self._voice_client.stop()
 
+    async def seek(self, position: float) -> None:
+        if not self._now_playing:
+            raise MusicPlayer.NotPlayingException
+        position = min(max(position, 0), self._now_playing.duration)
+        song, mixer = self._now_playing, self._mixer
+        source = await ffmpeg_supervisor.spawn(self._voice_client.guild.id, lambda: song.get_source(position))
+        if self._now_playing is not song or self._mixer is not mixer:  # ended while waiting for a FFmpeg slot
+            source.cleanup()
+            raise MusicPlayer.NotPlayingException
+        mixer.replace_source(source, int(position * FRAMES_PER_SECOND))
+
+    @property
+    def version(self) -> int:
+        """
+        Changes whenever the snapshot of the player changes, except for the position in the current song.
+        """
+        return self._version + self._song_queue.version
+
+    @property
+    def paused(self) -> bool:
+        return self._voice_client.is_paused()
+
+    @property
+    def position(self) -> float:
+        return self._mixer.position if self._now_playing and self._mixer else 0
+
     @property
     def loop(self) -> bool:
         return self._loop
@@ -46,6 +109,40 @@ class MusicPlayer:
     @loop.setter
     def loop(self, value: bool) -> None:
         self._loop = value
+        self._version += 1
+
+    @property
+    def autoplay(self) -> bool:
+        return self._autoplay
+
+    @autoplay.setter
+    def autoplay(self, value: bool) -> None:
+        self._autoplay = value
+        self._version += 1
+        if value and self._now_playing:
+            self._prepare_radio_song(self._now_playing)
+        elif not value:
+            self._cancel_radio_song()
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        self._volume = value
+        self._version += 1
+        if self._mixer:
+            self._mixer.volume = value
+
+    @property
+    def crossfade(self) -> int:
+        return self._crossfade
+
+    @crossfade.setter
+    def crossfade(self, seconds: int) -> None:
+        self._crossfade = seconds
+        self._version += 1
 
     @property
     def now_playing(self) -> Optional[Song]:
@@ -57,27 +154,121 @@ class MusicPlayer:
 
     async def stop(self) -> None:
         await self._song_queue.clear_queue()
+        self._stopping = True
+        self._stopped = True
         if self._now_playing:
             self._voice_client.stop()
         if self._processing_task:
             self._processing_task.cancel()
+        self._cancel_radio_song()
+        self._radio_seed = None
+        self._admission.release(self._voice_client.guild.id, self._looped_songs)
+        self._looped_songs.clear()
+        self._looped_durations.clear()
+        self._version += 1
+        self._radio.forget_guild(self._voice_client.guild.id)
+        ffmpeg_supervisor.kill_guild(self._voice_client.guild.id)  # the task may be cancelled while preparing a song
+        playback_monitor.remove(self._voice_client.guild.id)
         await self._voice_client.disconnect()
 
     async def clear_queue(self) -> None:
         await self._song_queue.clear_queue()
+        self._admission.release(self._voice_client.guild.id, self._looped_songs)
         self._looped_songs.clear()
+        self._looped_durations.clear()
+        self._version += 1
         self._clearing_queue = True
 
-    async def get_queue_info(self) -> tuple[Optional[Song], list[str]]:  # (now_playing_song, [queries])
-        waiting_in_queue = await self._song_queue.get_queue_info()
-        looped_songs = [song.title for song in self._looped_songs] if self._loop else []
+    async def get_queue_info(self, limit: int = 10) -> tuple[Optional[Song], list[str]]:  # (now_playing_song, [queries])
+        """
+        :param limit: number of songs at the start of the queue whose titles are returned
+        """
+        waiting_in_queue = await self._song_queue.get_queue_info(limit)
+        looped_songs = [song.title for song in self._looped_songs[:limit - len(waiting_in_queue)]] if self._loop else []
         return self._now_playing, waiting_in_queue + looped_songs
 
     async def queue_length(self) -> int:
         return await self._song_queue.queue_length() + (len(self._looped_songs) if self._loop else 0)
 
+    async def queue_stats(self, etas: int = 10) -> QueueStats:
+        """
+        :param etas: number of songs at the start of the queue whose ETAs are returned
+        """
+        queue_length = await self._song_queue.queue_length()
+        looped_length = len(self._looped_songs) if self._loop else 0
+        remaining = self._playback_remaining()
+        queue_duration = self._song_queue.duration()
+        return QueueStats(length=queue_length + looped_length,
+                          duration=remaining + queue_duration +
+                                   (self._looped_durations.known_duration if self._loop else 0),
+                          estimated=self._song_queue.has_estimates(),
+                          etas=[remaining + (self._song_queue.time_until(position) if position < queue_length else
+                                             queue_duration + self._looped_durations.prefix(position - queue_length)[0])
+                                for position in range(min(etas, queue_length + looped_length))])
+
+    def _playback_remaining(self) -> float:
+        return max(self._now_playing.duration - self.position, 0) if self._now_playing else 0
+
     async def play(self, song_request: SongRequest) -> None:
+        self._text_channel = song_request.channel
+        self._version += 1
         await self._song_queue.add(song_request)
+        self._start_processing()
+
+    async def add_songs(self, songs: list[Song], channel: Messageable) -> None:
+        self._text_channel = channel
+        self._version += 1
+        try:
+            await self._song_queue.add_songs(songs)
+        finally:  # some of the songs are added even if the queue is full
+            self._start_processing()
+
+    def snapshot(self) -> Optional[PlayerState]:
+        if not self._text_channel:
+            return None
+        songs, song_requests = self._song_queue.snapshot()
+        return PlayerState(voice_channel_id=self._voice_client.channel.id,
+                           text_channel_id=self._text_channel.id,
+                           loop=self._loop,
+                           volume=self._volume,
+                           crossfade=self._crossfade,
+                           now_playing=self._now_playing,
+                           position=int(self.position),
+                           songs=songs,
+                           queries=[(request.query, request.title) for request in song_requests],
+                           looped_songs=list(self._looped_songs),
+                           autoplay=self._autoplay)
+
+    def restore(self, state: PlayerState, text_channel: Messageable) -> None:
+        """
+        Restores the queue from the snapshot and resumes the song that was playing at its saved position.
+        Songs whose stream URLs have expired are requested again, looped songs when they are played again.
+        """
+        self._text_channel = text_channel
+        self._loop = state.loop
+        self._looped_songs = list(state.looped_songs)
+        self._looped_durations = DurationSequence((song, song.duration) for song in self._looped_songs)
+        self._admission.add(self._voice_client.guild.id, self._looped_songs)  # admitted before the restart
+        self.volume = state.volume
+        self._crossfade = state.crossfade
+        self._autoplay = state.autoplay
+
+        songs = ([state.now_playing] if state.now_playing else []) + state.songs
+        expired = next((i for i, song in enumerate(songs) if song.expires_at and song.expires_at < time()), len(songs))
+        song_requests = [self._restored_request(song.url, song.title, song.duration) for song in songs[expired:]]
+        song_requests += [self._restored_request(query, title) for query, title in state.queries]
+        if state.now_playing and expired:
+            self._now_playing = songs.pop(0)
+            self._resume_offset = state.position
+            expired -= 1
+        self._song_queue.restore(songs[:expired], song_requests)
+        self._start_processing()
+
+    def _restored_request(self, query: str, title: Optional[str], duration: Optional[int] = None) -> SongRequest:
+        return SongRequest(query, self._text_channel, self._voice_client.guild, quiet=True, _title=title,
+                           duration=duration)
+
+    def _start_processing(self) -> None:
         if not self._processing_queue:
             self._processing_task = asyncio.create_task(self._process_song_queue())
 
@@ -86,32 +277,215 @@ class MusicPlayer:
 
     async def _process_song_queue(self) -> None:
         self._processing_queue = True
+        finished: Optional[asyncio.Event] = None
+        loop = asyncio.get_running_loop()
         try:
-            while True:
-                try:
-                    self._now_playing = await self._song_queue.next()
-                except SongQueue.EndOfPlaylistException:
-                    if self.loop and self._looped_songs:
-                        self._now_playing = self._looped_songs.pop(0)
-                    else:
-                        break
-                source = await self._now_playing.get_source()
-                finished = asyncio.Event()
-                self._voice_client.play(source, after=lambda e: self._after_playing(e, finished))
-                await finished.wait()
-                self._now_playing = None
+            song = await self._next_song()
+            while song:
+                # a stream may fail before its first frame, so the offset of a resumed song can be 0
+                resuming = self._resume_offset is not None
+                offset, self._resume_offset = self._resume_offset or 0, None
+                if not resuming:
+                    self._resume_attempts = 0
+                elif self._resume_attempts:  # after a stream error, not after a restart
+                    song = await self._refresh_stream(song)
+                    if not song:
+                        self._now_playing = None
+                        self._version += 1
+                        song = await self._next_song()
+                        continue
+                self._stopping = False
+                if song.trace:
+                    song.trace.span_since("resolved", "waiting in queue")
+                with span(song.trace, "ffmpeg spawn"):
+                    source = await ffmpeg_supervisor.spawn(self._voice_client.guild.id,
+                                                           lambda: song.get_source(offset))
+                if not resuming:
+                    if not self._replaying:  # looped songs would inflate how often they are played together
+                        self._radio.record(self._voice_client.guild.id, song, chosen=song is not self._radio_song)
+                    self._radio_seed = song
+                    if await self._queue_running_out():
+                        self._prepare_radio_song(song)
+                    else:  # picked for an earlier song, the queue has been filled since
+                        self._cancel_radio_song()
+                if finished and not finished.is_set() and self._mixer.crossfade_into(source, self._crossfade):
+                    self._song_finished(self._now_playing)  # previous song is fading out
+                    self._now_playing = song
+                    self._version += 1
+                    self._trace_first_frame(song)
+                else:
+                    if finished:
+                        await finished.wait()
+                    finished = asyncio.Event()
+                    self._now_playing = song
+                    self._version += 1
+                    self._mixer = AudioMixer(source, self._volume, int(offset * FRAMES_PER_SECOND))
+                    self._trace_first_frame(song)
+                    # the callback is called on the audio player thread, the player is only changed on the event loop
+                    self._monitored_source = playback_monitor.wrap(self._voice_client.guild.id, self._mixer)
+                    self._voice_client.play(self._monitored_source,
+                                            after=lambda e, f=finished: self._call_soon(loop, self._after_playing,
+                                                                                        e, f))
+                song = await self._wait_for_next_song(song, finished)
         except asyncio.CancelledError:
             pass
         finally:
             self._processing_queue = False
 
-    def _after_playing(self, error: Optional[Exception], finished: asyncio.Event) -> None:
-        if self.loop:
+    async def _refresh_stream(self, song: Song) -> Optional[Song]:
+        """
+        Extracts a new stream URL of a song whose stream has expired or died.
+        Returns None if the song can't be played.
+        """
+        try:
+            refreshed = await self._song_downloader.refresh_song(song, self._voice_client.channel.bitrate)
+        except DownloaderException as e:
+            logging.warning(f"Failed to refresh the stream of {song.title}, skipping it: {e}")
+            return None
+        return refreshed
+
+    def _trace_first_frame(self, song: Song) -> None:
+        trace = song.trace
+        if trace:
+            def first_frame() -> None:
+                trace.event("first audio frame")
+                trace.finish()
+            self._mixer.set_marker(self._mixer.frame + 1, first_frame)
+            # the trace is handed to the writer thread when it finishes, looped replays must not record into it
+            song.trace = None
+
+    async def _next_song(self) -> Optional[Song]:
+        if self._resume_offset is not None:
+            return self._now_playing
+        self._replaying = False
+        try:
+            return await self._song_queue.next()
+        except SongQueue.EndOfPlaylistException:
+            while self.loop and self._looped_songs:
+                song = self._looped_songs.pop(0)
+                self._looped_durations.remove(song)
+                self._version += 1
+                self._admission.release(self._voice_client.guild.id, [song])
+                if song.expires_at and song.expires_at < time():  # e.g. restored or looped for hours
+                    song = await self._refresh_stream(song)
+                if song:
+                    self._replaying = True
+                    return song
+            if self._autoplay:
+                return await self._next_radio_song()
+            return None
+
+    async def _queue_running_out(self) -> bool:
+        # looped songs are played again once the queue is empty, so autoplay is not needed while looping
+        return not self._loop and not await self._song_queue.queue_length()
+
+    def _prepare_radio_song(self, song: Song) -> None:
+        """
+        Resolves the song autoplay would play after the given one in the background,
+        so it is ready when the queue runs out.
+        """
+        self._cancel_radio_song()
+        if self._autoplay:
+            self._radio_task = asyncio.create_task(self._radio.pick(self._voice_client.guild.id, song,
+                                                                    self._voice_client.channel.bitrate))
+
+    def _cancel_radio_song(self) -> None:
+        if self._radio_task:
+            self._radio_task.cancel()
+            self._radio_task = None
+
+    async def _next_radio_song(self) -> Optional[Song]:
+        task, self._radio_task = self._radio_task, None
+        if not task and self._radio_seed:  # not prepared, e.g. the queue was cleared
+            task = asyncio.create_task(self._radio.pick(self._voice_client.guild.id, self._radio_seed,
+                                                        self._voice_client.channel.bitrate))
+        if not task:
+            return None
+        try:
+            song = await task
+        except Exception as e:
+            logging.error(f"Error picking the song to autoplay: {e}", exc_info=True)
+            return None
+        self._radio_song = song
+        if song and self._text_channel:
+            try:
+                await self._text_channel.send(embed=autoplaying(song))
+            except HTTPException as e:
+                logging.warning(f"Failed to announce the autoplayed song {song.title}: {e}")
+        return song
+
+    async def _wait_for_next_song(self, song: Song, finished: asyncio.Event) -> Optional[Song]:
+        """
+        Returns the song that should be played after the given one.
+        With crossfade enabled, it returns as soon as the song starts fading out, otherwise when it ends.
+        """
+        if not self._crossfade or song.duration <= self._crossfade + self._mixer.position:
+            await finished.wait()
+            return await self._next_song()
+
+        fade_point = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._mixer.set_marker((song.duration - self._crossfade) * FRAMES_PER_SECOND,
+                               lambda: loop.call_soon_threadsafe(fade_point.set))
+        await self._wait_first(finished.wait(), fade_point.wait())
+        next_song = await self._next_song()
+        if not next_song and not finished.is_set():  # nothing to fade into, the song may be looped after it ends
+            await finished.wait()
+            next_song = await self._next_song()
+        return next_song
+
+    @staticmethod
+    async def _wait_first(*aws) -> None:
+        tasks = [asyncio.ensure_future(aw) for aw in aws]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, callback: Callable[..., None], *args) -> None:
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(callback, *args)
+
+    def _song_finished(self, song: Optional[Song]) -> None:
+        if self.loop and song and not self._stopped:
             if self._clearing_queue:
                 self._clearing_queue = False
-            else:
-                self._looped_songs.append(self._now_playing)
-        self._now_playing = None
+                return
+            try:
+                self._admission.admit(self._voice_client.guild.id, [song])
+            except QueueAdmission.LimitReached as e:  # the looped songs are limited like the queue
+                logging.info(f"Song {song.title} not looped in guild {self._voice_client.guild.id}, "
+                             f"queue limit {e.limit} reached")
+                if self._text_channel:
+                    self._message_batcher.send(self._text_channel, queue_full(e.limit))
+                return
+            self._looped_songs.append(song)
+            self._looped_durations.append(song, song.duration)
+            self._version += 1
+
+    def _after_playing(self, error: Optional[Exception], finished: asyncio.Event) -> None:
         if error:
             logging.error(f"Error playing song: {error}", exc_info=True)
+        if self._should_resume(error):
+            self._resume_offset = self._mixer.position
+            logging.warning(f"Stream of {self._now_playing.title} ended at {self._resume_offset:.1f}s, resuming")
+        else:
+            self._song_finished(self._now_playing)
+            self._now_playing = None
+            self._version += 1
         finished.set()
+
+    def _should_resume(self, error: Optional[Exception]) -> bool:
+        """
+        The song is resumed at the current position if the stream failed or ended before the end of the song,
+        which happens when the connection to the stream is lost.
+        """
+        if self._stopping or not self._now_playing or self._resume_attempts >= MAX_RESUME_ATTEMPTS:
+            return False
+        if not error and self._mixer.position >= self._now_playing.duration - RESUME_TOLERANCE:
+            return False
+        self._resume_attempts += 1
+        return True
@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Optional
+
+from .song import Song
+
+
+@dataclass
+class PlayerState:
+    """
+    Snapshot of a music player, allows restoring the queue after the bot restarts.
+    Resolved songs keep their stream URLs, so they don't have to be resolved again.
+    """
+    voice_channel_id: int
+    text_channel_id: int
+    loop: bool
+    volume: float
+    crossfade: int
+    now_playing: Optional[Song]
+    position: int  # seconds
+    songs: list[Song] = field(default_factory=list)
+    queries: list[tuple[str, Optional[str]]] = field(default_factory=list)  # (query, title) of unresolved requests
+    looped_songs: list[Song] = field(default_factory=list)
+    autoplay: bool = False
+
+    def to_json(self) -> str:
+        state = {state_field.name: getattr(self, state_field.name) for state_field in fields(self)}
+        state["now_playing"] = _song_dict(self.now_playing) if self.now_playing else None
+        state["songs"] = [_song_dict(song) for song in self.songs]
+        state["looped_songs"] = [_song_dict(song) for song in self.looped_songs]
+        return json.dumps(state, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str) -> "PlayerState":
+        state = json.loads(data)
+        state["now_playing"] = Song(**state["now_playing"]) if state["now_playing"] else None
+        state["songs"] = [Song(**song) for song in state["songs"]]
+        state["queries"] = [tuple(query) for query in state["queries"]]
+        state["looped_songs"] = [Song(**song) for song in state["looped_songs"]]
+        return cls(**state)
+
+
+def _song_dict(song: Song) -> dict:
+    # traces belong to the running requests, they are not saved
+    return {song_field.name: getattr(song, song_field.name) for song_field in fields(Song)
+            if song_field.name != "trace"}
+
+
+class QueueStateStore:
+    """
+    Stores the player snapshots in a directory, one small file per guild.
+    A file is rewritten only when the snapshot of its guild has changed.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+        self._saved: dict[int, str] = {}  # guild_id: last written snapshot
+
+    def save(self, guild_id: int, state: PlayerState) -> None:
+        data = state.to_json()
+        if self._saved.get(guild_id) == data:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(guild_id)
+        temporary_path = path.with_suffix(".tmp")
+        temporary_path.write_text(data)
+        os.replace(temporary_path, path)  # atomic, a crash while writing does not corrupt the previous snapshot
+        self._saved[guild_id] = data
+
+    def delete(self, guild_id: int) -> None:
+        self._saved.pop(guild_id, None)
+        self._path(guild_id).unlink(missing_ok=True)
+
+    def load_all(self) -> dict[int, PlayerState]:
+        states = {}
+        for path in self._directory.glob("*.json"):
+            try:
+                data = path.read_text()
+                states[int(path.stem)] = PlayerState.from_json(data)
+                self._saved[int(path.stem)] = data
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Skipping invalid queue snapshot {path}: {e}")
+        return states
+
+    def _path(self, guild_id: int) -> Path:
+        return self._directory / f"{guild_id}.json"
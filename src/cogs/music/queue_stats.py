@@ -0,0 +1,152 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+
+@dataclass
+class QueueStats:
+    length: int
+    duration: float  # seconds until everything in the queue is played, including the rest of the current song
+    estimated: bool  # whether some of the songs are not resolved yet and their durations are estimated
+    etas: list[float]  # seconds until the first songs of the queue start playing
+
+
+class _FenwickTree:
+    """
+    Binary indexed tree, prefix sums and updates of single values in O(log n).
+    """
+
+    def __init__(self, values: list[float]) -> None:
+        self._tree = [0.0] + values
+        for i in range(1, len(self._tree)):  # built in O(n)
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def add(self, index: int, delta: float) -> None:
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, count: int) -> float:
+        """
+        Sum of the first count values.
+        """
+        total = 0.0
+        i = count
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def lower_bound(self, target: float) -> int:
+        """
+        Smallest count of the first values whose sum reaches the target, the values must not be negative.
+        """
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if position + step < len(self._tree) and self._tree[position + step] < target:
+                position += step
+                target -= self._tree[position]
+            step >>= 1
+        return position + 1
+
+
+class DurationSequence:
+    """
+    Durations of the entries of a queue in their order, with running totals and prefix sums,
+    so the time until any entry is played is known without walking the queue.
+    Entries are appended at the end and removed from anywhere, both in O(log n).
+    Every entry takes a slot in the trees, the slots of removed entries are reclaimed when the trees are rebuilt.
+    """
+
+    def __init__(self, entries: Iterable[tuple[object, Optional[float]]] = ()) -> None:
+        self._reset(list(entries))
+
+    def append(self, entry: object, duration: Optional[float]) -> None:
+        if self._next_slot == self._capacity:
+            self._reset(self._live_entries(), capacity=max(2 * len(self), 16))
+        self._set(self._next_slot, entry, duration)
+        self._next_slot += 1
+
+    def remove(self, entry: object) -> None:
+        # the first occurrence, as list.remove does
+        slots = self._slots.get(id(entry))
+        if not slots:
+            return
+        slot = slots.popleft()
+        if not slots:
+            del self._slots[id(entry)]
+        _, duration = self._values.pop(slot)
+        self._counts.add(slot, -1)
+        self._length -= 1
+        if duration is None:
+            self._unknown.add(slot, -1)
+            self._unknown_count -= 1
+        else:
+            self._durations.add(slot, -duration)
+            self._total -= duration
+
+    def reorder(self, entries: Iterable[tuple[object, Optional[float]]]) -> None:
+        """
+        Replaces the entries, e.g. after shuffling the queue, in O(n).
+        """
+        self._reset(list(entries))
+
+    def clear(self) -> None:
+        self._reset([])
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def known_duration(self) -> float:
+        return self._total
+
+    @property
+    def unknown_count(self) -> int:
+        return self._unknown_count
+
+    def prefix(self, count: int) -> tuple[float, int]:
+        """
+        Returns the known duration and the number of unknown durations of the first count entries.
+        """
+        if count <= 0:
+            return 0.0, 0
+        if count >= self._length:
+            return self._total, self._unknown_count
+        slots = self._counts.lower_bound(count)
+        return self._durations.prefix(slots), round(self._unknown.prefix(slots))
+
+    def _set(self, slot: int, entry: object, duration: Optional[float]) -> None:
+        self._slots.setdefault(id(entry), deque()).append(slot)
+        self._values[slot] = (entry, duration)
+        self._counts.add(slot, 1)
+        self._length += 1
+        if duration is None:
+            self._unknown.add(slot, 1)
+            self._unknown_count += 1
+        else:
+            self._durations.add(slot, duration)
+            self._total += duration
+
+    def _live_entries(self) -> list[tuple[object, Optional[float]]]:
+        return list(self._values.values())  # slots are inserted in increasing order
+
+    def _reset(self, entries: list[tuple[object, Optional[float]]], capacity: Optional[int] = None) -> None:
+        self._capacity = capacity or max(2 * len(entries), 16)
+        self._slots: dict[int, deque[int]] = {}  # id(entry): slots of the entry, in the order of the queue
+        self._values: dict[int, tuple[object, Optional[float]]] = {}  # slot: (entry, duration)
+        for slot, (entry, duration) in enumerate(entries):
+            self._slots.setdefault(id(entry), deque()).append(slot)
+            self._values[slot] = (entry, duration)
+        padding = [0.0] * (self._capacity - len(entries))
+        self._counts = _FenwickTree([1.0] * len(entries) + padding)
+        self._durations = _FenwickTree([duration or 0.0 for _, duration in entries] + padding)
+        self._unknown = _FenwickTree([1.0 if duration is None else 0.0 for _, duration in entries] + padding)
+        self._next_slot = len(entries)
+        self._length = len(entries)
+        self._total = sum(duration for _, duration in entries if duration is not None)
+        self._unknown_count = sum(1 for _, duration in entries if duration is None)
@@ -0,0 +1,100 @@
+import logging
+from collections import Counter, OrderedDict, deque
+from typing import Optional
+
+from .music_downloader import SongDownloader, DownloaderException
+from .song import Song
+
+
+class PlayHistoryIndex:
+    """
+    Counts how often songs are played close to each other in the same guild,
+    e.g. songs often queued together by the listeners of a guild are related.
+    """
+
+    def __init__(self, max_size: int, window: int, recent_size: int) -> None:
+        """
+        :param window: number of previously played songs a new song is related to
+        :param recent_size: number of the latest songs of every guild which are not picked again
+        """
+        self._max_size = max_size
+        self._window = window
+        self._recent_size = recent_size
+        self._related: OrderedDict[str, Counter[str]] = OrderedDict()  # url: urls played close to it
+        self._recent: dict[int, deque[tuple[str, bool]]] = {}  # guild_id: latest played (url, chosen)
+
+    def record(self, guild_id: int, url: str, chosen: bool = True) -> None:
+        """
+        :param chosen: whether the song was chosen by the listeners, songs picked by the radio only count as recent
+        """
+        recent = self._recent.setdefault(guild_id, deque(maxlen=self._recent_size))
+        if chosen:
+            chosen_urls = [previous_url for previous_url, previous_chosen in recent if previous_chosen]
+            for previous_url in chosen_urls[-self._window:]:
+                if previous_url != url:
+                    self._related_to(url)[previous_url] += 1
+                    self._related_to(previous_url)[url] += 1
+        recent.append((url, chosen))
+
+    def related(self, url: str) -> list[str]:
+        """
+        Returns the songs played close to the given one, most frequent first.
+        """
+        if url not in self._related:
+            return []
+        self._related.move_to_end(url)
+        return [related_url for related_url, _ in self._related[url].most_common()]
+
+    def recent(self, guild_id: int) -> set[str]:
+        return {url for url, _ in self._recent.get(guild_id, ())}
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._recent.pop(guild_id, None)
+
+    def _related_to(self, url: str) -> Counter[str]:
+        if url in self._related:
+            self._related.move_to_end(url)
+            return self._related[url]
+        related = self._related[url] = Counter()
+        if len(self._related) > self._max_size:
+            self._related.popitem(last=False)
+        return related
+
+
+class Radio:
+    """
+    Picks the song to play after the given one when the queue runs out.
+    Songs related by the play history are preferred, YouTube's related videos are used otherwise.
+    """
+
+    def __init__(self, history: PlayHistoryIndex, song_downloader: SongDownloader, max_attempts: int) -> None:
+        self._history = history
+        self._song_downloader = song_downloader
+        self._max_attempts = max_attempts
+
+    def record(self, guild_id: int, song: Song, chosen: bool = True) -> None:
+        self._history.record(guild_id, song.url, chosen)
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._history.forget_guild(guild_id)
+
+    async def pick(self, guild_id: int, song: Song, bitrate: Optional[int] = None) -> Optional[Song]:
+        """
+        Returns a resolved song related to the given one which was not played recently in the guild,
+        or None if there is none.
+        """
+        recent = self._history.recent(guild_id) | {song.url}
+        candidates = [url for url in self._history.related(song.url) if url not in recent]
+        if not candidates:
+            try:
+                candidates = [url for url in await self._song_downloader.related_urls(song.url) if url not in recent]
+            except DownloaderException as e:
+                logging.info(f"No related songs found for {song.url}: {type(e).__name__}")
+                return None
+
+        for url in candidates[:self._max_attempts]:
+            try:
+                return await self._song_downloader.prepare_song(url, bitrate, exact=True)
+            except DownloaderException as e:
+                logging.debug(f"Skipping related song {url}: {type(e).__name__}")
+        return None
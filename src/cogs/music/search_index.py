@@ -0,0 +1,89 @@
+import re
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from .song import Song
+
+
+class SongSearchIndex:
+    """
+    Trigram index over the titles of previously resolved songs.
+    Answers free-text queries which are close enough to a known title, e.g. "never gonna give you up rick astley"
+    and "rick astley never gonna" both match "Rick Astley - Never Gonna Give You Up (Official Video)",
+    so they don't have to be searched on YouTube again.
+    """
+
+    _word_regex = re.compile(r"\w+")
+    # words which are often in the titles but rarely in the queries
+    _noise_words = {"official", "video", "music", "audio", "lyrics", "lyric", "hd", "hq", "4k", "mv", "remastered",
+                    "remaster", "ft", "feat"}
+
+    def __init__(self, max_size: int, confidence: float, min_coverage: float) -> None:
+        """
+        :param confidence: part of the query trigrams that have to be found in the title,
+                           and of the trigrams of every word of the query, so a short word like "live" is not ignored
+        :param min_coverage: part of the title trigrams that have to be found in the query
+        """
+        self._max_size = max_size
+        self._confidence = confidence
+        self._min_coverage = min_coverage
+        self._titles: OrderedDict[str, frozenset[str]] = OrderedDict()  # url: trigrams of the title
+        self._postings: dict[str, set[str]] = {}  # trigram: urls of songs with the trigram in the title
+
+    def add(self, song: Song) -> None:
+        if song.url in self._titles:
+            self._titles.move_to_end(song.url)
+            return
+        trigrams = self._trigrams(song.title, skip_noise=True)
+        if not trigrams:
+            return
+        self._titles[song.url] = frozenset(trigrams)
+        for trigram in trigrams:
+            self._postings.setdefault(trigram, set()).add(song.url)
+        if len(self._titles) > self._max_size:
+            self._remove(next(iter(self._titles)))
+
+    def find(self, query: str) -> Optional[str]:
+        """
+        Returns the URL of the song matching the query, or None if there is no match
+        or the query is ambiguous, i.e. it matches more than one song equally well.
+        """
+        trigrams = self._trigrams(query, skip_noise=False)
+        if not trigrams:
+            return None
+        # noise words are not indexed, so they can't be required
+        words = [self._word_trigrams(word) for word in self._words(query) if word not in self._noise_words]
+        shared = Counter(url for trigram in trigrams for url in self._postings.get(trigram, ()))
+        matches = sorted(((count / len(trigrams), url) for url, count in shared.items()
+                          if count / len(self._titles[url]) >= self._min_coverage
+                          and self._covers_words(self._titles[url], words)), reverse=True)
+        if not matches or matches[0][0] < self._confidence:
+            return None
+        if len(matches) > 1 and matches[1][0] == matches[0][0]:
+            return None
+        self._titles.move_to_end(matches[0][1])
+        return matches[0][1]
+
+    def _remove(self, url: str) -> None:
+        for trigram in self._titles.pop(url):
+            urls = self._postings[trigram]
+            urls.discard(url)
+            if not urls:
+                del self._postings[trigram]
+
+    def _covers_words(self, title: frozenset[str], words: list[set[str]]) -> bool:
+        return all(len(word & title) >= self._confidence * len(word) for word in words)
+
+    @classmethod
+    def _words(cls, text: str) -> list[str]:
+        return cls._word_regex.findall(text.lower())
+
+    @staticmethod
+    def _word_trigrams(word: str) -> set[str]:
+        # every word is padded, so the word order does not matter and short words still produce trigrams
+        return {f" {word} "[i:i + 3] for i in range(len(word))}
+
+    @classmethod
+    def _trigrams(cls, text: str, skip_noise: bool) -> set[str]:
+        return {trigram for word in cls._words(text) if not (skip_noise and word in cls._noise_words)
+                for trigram in cls._word_trigrams(word)}
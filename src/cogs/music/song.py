@@ -1,7 +1,9 @@
 from typing import Optional
-from dataclasses import dataclass
-from discord import FFmpegPCMAudio
-from discord.ext import commands
+from dataclasses import dataclass, field
+from discord import FFmpegPCMAudio, Guild
+from discord.abc import Messageable
+
+from .tracing import Trace
 
 
 @dataclass
@@ -12,24 +14,38 @@ class Song:
     thumbnail: Optional[str]
     expires_at: Optional[int]
     _stream_url: Optional[str]
+    # set on the copy of a song made for a single request, not stored in the cache or in the queue snapshots
+    trace: Optional[Trace] = field(default=None, compare=False, repr=False)
 
     _ffmpeg_options = {
         'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
         'options': '-vn'
     }
 
-    async def get_source(self) -> FFmpegPCMAudio:
+    async def get_source(self, offset: float = 0) -> FFmpegPCMAudio:
         # every time get_source is called, the FFPCMAudio object is created
         # it has to be created every time because it is not reusable
-        return FFmpegPCMAudio(self._stream_url, **self._ffmpeg_options)
+        before_options = self._ffmpeg_options['before_options']
+        if offset:
+            # input side seeking, FFmpeg requests the stream from the offset instead of decoding it from the start
+            before_options += f" -ss {offset:.2f}"
+        return FFmpegPCMAudio(self._stream_url, before_options=before_options, options=self._ffmpeg_options['options'])
 
 
 @dataclass
 class SongRequest:
     _query: str
-    ctx: commands.Context
+    channel: Messageable  # text channel the messages about the request are sent to
+    guild: Guild
     quiet: bool = False  # whether to send a message after adding the song to the queue
     _title: Optional[str] = None
+    exact: bool = False  # whether to search YouTube even if a song with a similar title is known
+    trace: Optional[Trace] = None
+    duration: Optional[int] = None  # known before resolving the song, e.g. from the playlist
+
+    @property
+    def query(self) -> str:
+        return self._query
 
     @property
     def title(self) -> str:
@@ -39,6 +55,10 @@ class SongRequest:
     def title(self, value: str) -> None:
         self._title = value
 
+    @property
+    def bitrate(self) -> Optional[int]:
+        voice_client = self.guild.voice_client
+        return voice_client.channel.bitrate if voice_client else None
 
 
 @dataclass
@@ -7,18 +7,21 @@ from time import time
 from .song import Song
 
 
+CacheKey = tuple[str, int]  # (query or url, bitrate tier in kbps)
+
+
 class SongsCache(ABC):
     # May be implemented with a database or a cache
     @abstractmethod
-    def __contains__(self, query: str) -> bool:
+    def __contains__(self, key: CacheKey) -> bool:
         pass
 
     @abstractmethod
-    def __getitem__(self, query: str) -> Song:
+    def __getitem__(self, key: CacheKey) -> Song:
         pass
 
     @abstractmethod
-    def __setitem__(self, query: str, song: Song) -> None:
+    def __setitem__(self, key: CacheKey, song: Song) -> None:
         pass
 
 
@@ -26,6 +29,7 @@ class LRUSongsCache(SongsCache):
     """
     Implements the Least Recently Used (LRU) cache for storing song data and
     related queries. Songs are stored by their URL and queries.
+    Stream URLs depend on the selected audio format, so songs are kept separately for every bitrate tier.
     """
 
     _youtube_regex = re.compile(
@@ -33,18 +37,19 @@ class LRUSongsCache(SongsCache):
     )
 
     def __init__(self, songs_size: int, queries_size: int):
-        self._url_cache: LRUCache[str, Song] = LRUCache(maxsize=songs_size)  # url: song
+        self._url_cache: LRUCache[CacheKey, Song] = LRUCache(maxsize=songs_size)  # (url, bitrate): song
         self._query_cache: LRUCache[str, str] = LRUCache(maxsize=queries_size)  # query: url
 
-    def __contains__(self, key: str) -> bool:
-        if key in self._query_cache:
-            song_url = self._query_cache[key]
+    def __contains__(self, key: CacheKey) -> bool:
+        query, bitrate = key
+        if query in self._query_cache:
+            song_key = (self._query_cache[query], bitrate)
         elif key in self._url_cache:
-            song_url = key
+            song_key = key
         else:
             return False
 
-        song = self._url_cache.get(song_url)
+        song = self._url_cache.get(song_key)
         if not song:
             return False
 
@@ -53,17 +58,19 @@ class LRUSongsCache(SongsCache):
         if song.expires_at + song.duration > current_time:
             return True
         else:
-            del self._url_cache[song_url]
+            del self._url_cache[song_key]
             return False
 
-    def __getitem__(self, key: str) -> Song:
+    def __getitem__(self, key: CacheKey) -> Song:
         if key in self._url_cache:
             return self._url_cache[key]
-        return self._url_cache[self._query_cache[key]]
+        query, bitrate = key
+        return self._url_cache[self._query_cache[query], bitrate]
 
-    def __setitem__(self, query: str, song: Song) -> None:
+    def __setitem__(self, key: CacheKey, song: Song) -> None:
         if not song.expires_at:
             return
-        self._url_cache[song.url] = song
+        query, bitrate = key
+        self._url_cache[song.url, bitrate] = song
         if self._youtube_regex.match(query):
             self._query_cache[query] = song.url
@@ -1,14 +1,20 @@
 import asyncio
 import logging
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Awaitable, Callable, Optional, TypeVar
 
 from .messages import *
 from .music_downloader import SongDownloader, DownloaderException, PlaylistFoundException, PlaylistExtractor, \
-    PlaylistNotFoundError
+    PlaylistNotFoundError, ThrottledException
+from .admission import QueueAdmission
+from .message_batcher import MessageBatcher
+from .queue_stats import DurationSequence
 from .song import SongRequest
+from copy import copy
 from random import shuffle
 
+T = TypeVar("T")
+
 
 class SongQueue(ABC):
     class EndOfPlaylistException(Exception):
@@ -21,6 +27,16 @@ class SongQueue(ABC):
 
     @abstractmethod
     async def add(self, song_request: SongRequest) -> None:
+        """
+        :raises QueueAdmission.LimitReached: if the queue is full
+        """
+        pass
+
+    @abstractmethod
+    async def add_songs(self, songs: list[Song]) -> None:
+        """
+        :raises QueueAdmission.LimitReached: if not all songs fit into the queue, the ones that fit are added
+        """
         pass
 
     @abstractmethod
@@ -28,26 +44,82 @@ class SongQueue(ABC):
         pass
 
     @abstractmethod
-    async def get_queue_info(self) -> list[str]:
+    async def get_queue_info(self, limit: int) -> list[str]:
+        """
+        :param limit: number of songs at the start of the queue whose titles are returned
+        """
         pass
 
     @abstractmethod
     async def queue_length(self) -> int:
         pass
 
+    @abstractmethod
+    def duration(self) -> float:
+        """
+        Seconds until all songs in the queue are played, not counting the current song.
+        """
+        pass
+
+    @abstractmethod
+    def time_until(self, position: int) -> float:
+        """
+        Seconds until the song at the position starts playing, not counting the rest of the current song.
+        """
+        pass
+
+    @abstractmethod
+    def has_estimates(self) -> bool:
+        """
+        Whether the durations of some songs are estimated, because they are not resolved yet.
+        """
+        pass
+
+    @abstractmethod
+    def set_playback_remaining(self, playback_remaining: Callable[[], float]) -> None:
+        """
+        :param playback_remaining: returns the seconds until the current song ends, used for the ETAs of added songs
+        """
+        pass
+
     @abstractmethod
     async def shuffle(self) -> None:
         pass
 
+    @property
+    @abstractmethod
+    def version(self) -> int:
+        """
+        Changes whenever the snapshot of the queue changes, so unchanged queues are not saved again.
+        """
+        pass
+
+    @abstractmethod
+    def snapshot(self) -> tuple[list[Song], list[SongRequest]]:  # (resolved songs, unresolved requests)
+        pass
+
+    @abstractmethod
+    def restore(self, songs: list[Song], song_requests: list[SongRequest]) -> None:
+        pass
+
 
 class BgDownloadSongQueue(SongQueue):
 
-    def __init__(self, song_downloader: SongDownloader):
+    def __init__(self, song_downloader: SongDownloader, message_batcher: MessageBatcher, admission: QueueAdmission,
+                 guild_id: int):
         self._music_downloader = song_downloader
+        self._message_batcher = message_batcher
+        self._admission = admission
+        self._guild_id = guild_id
         self._downloaded_songs: list[Song] = []
         self._waiting_queries: list[SongRequest] = []
+        # durations of the songs and the requests in the same order, updated together with the lists
+        self._song_durations = DurationSequence()
+        self._request_durations = DurationSequence()
+        self._playback_remaining: Callable[[], float] = lambda: 0
         self._processing_task: Optional[asyncio.Task] = None
         self._song_available = asyncio.Event()
+        self._version = 0
 
     async def next(self) -> Song:
         if not self._downloaded_songs and not self._processing_task:
@@ -56,62 +128,189 @@ class BgDownloadSongQueue(SongQueue):
         if not self._downloaded_songs:  # edge case when the queue is cleared
             raise SongQueue.EndOfPlaylistException
         song = self._downloaded_songs.pop(0)
+        self._song_durations.remove(song)
+        self._version += 1
+        self._admission.release(self._guild_id, [song])
         if not self._downloaded_songs:
             self._song_available.clear()
         return song
 
     async def add(self, song_request: SongRequest) -> None:
+        self._admission.admit(self._guild_id, [song_request])
         self._waiting_queries.append(song_request)
+        self._request_durations.append(song_request, song_request.duration)
+        self._version += 1
         if not self._processing_task:
             self._processing_task = asyncio.create_task(self._process_queue())
 
+    async def add_songs(self, songs: list[Song]) -> None:
+        # already resolved, e.g. loaded from a track list
+        try:
+            self._admission.admit(self._guild_id, songs)
+        except QueueAdmission.LimitReached as e:
+            songs = songs[:e.admitted]
+            raise
+        finally:
+            self._downloaded_songs.extend(songs)
+            for song in songs:
+                self._song_durations.append(song, song.duration)
+            self._version += 1
+            if self._downloaded_songs:
+                self._song_available.set()
+
     async def clear_queue(self) -> None:
         if self._processing_task:
             self._processing_task.cancel()
+        self._admission.release(self._guild_id, self._downloaded_songs + self._waiting_queries)
         self._waiting_queries.clear()
         self._downloaded_songs.clear()
+        self._song_durations.clear()
+        self._request_durations.clear()
+        self._version += 1
         self._song_available.clear()
 
-    async def get_queue_info(self) -> list[str]:
-        return [song.title for song in self._downloaded_songs] + [sr.title for sr in self._waiting_queries]
+    async def get_queue_info(self, limit: int) -> list[str]:
+        return ([song.title for song in self._downloaded_songs[:limit]] +
+                [sr.title for sr in self._waiting_queries[:max(limit - len(self._downloaded_songs), 0)]])
 
     async def queue_length(self) -> int:
-        return len(await self.get_queue_info())
+        return len(self._downloaded_songs) + len(self._waiting_queries)
+
+    def duration(self) -> float:
+        return self._estimate(self._song_durations.known_duration + self._request_durations.known_duration,
+                              self._song_durations.unknown_count + self._request_durations.unknown_count)
+
+    def time_until(self, position: int) -> float:
+        known, unknown = self._song_durations.prefix(position)
+        if position > len(self._song_durations):
+            request_known, request_unknown = self._request_durations.prefix(position - len(self._song_durations))
+            known, unknown = known + request_known, unknown + request_unknown
+        return self._estimate(known, unknown)
+
+    def has_estimates(self) -> bool:
+        return bool(self._song_durations.unknown_count + self._request_durations.unknown_count)
+
+    def set_playback_remaining(self, playback_remaining: Callable[[], float]) -> None:
+        self._playback_remaining = playback_remaining
+
+    def _estimate(self, known: float, unknown: int) -> float:
+        # songs that are not resolved yet are expected to be as long as the others in the queue
+        unknown_total = self._song_durations.unknown_count + self._request_durations.unknown_count
+        known_count = len(self._song_durations) + len(self._request_durations) - unknown_total
+        known_total = self._song_durations.known_duration + self._request_durations.known_duration
+        average = known_total / known_count if known_count else ESTIMATED_SONG_DURATION
+        return known + unknown * average
 
     async def shuffle(self) -> None:
         shuffle(self._downloaded_songs)
         shuffle(self._waiting_queries)
+        self._song_durations.reorder((song, song.duration) for song in self._downloaded_songs)
+        self._request_durations.reorder((request, request.duration) for request in self._waiting_queries)
+        self._version += 1
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def snapshot(self) -> tuple[list[Song], list[SongRequest]]:
+        return list(self._downloaded_songs), list(self._waiting_queries)
+
+    def restore(self, songs: list[Song], song_requests: list[SongRequest]) -> None:
+        # the songs were admitted before the restart, so they are restored even if the limits have changed
+        self._admission.add(self._guild_id, songs + song_requests)
+        self._downloaded_songs.extend(songs)
+        for song in songs:
+            self._song_durations.append(song, song.duration)
+        if self._downloaded_songs:
+            self._song_available.set()
+        self._waiting_queries.extend(song_requests)
+        for song_request in song_requests:
+            self._request_durations.append(song_request, song_request.duration)
+        self._version += 1
+        if self._waiting_queries and not self._processing_task:
+            self._processing_task = asyncio.create_task(self._process_queue())
 
     async def _process_queue(self) -> None:
         try:
             while self._waiting_queries:
                 song_request = self._waiting_queries[0]
+                trace = song_request.trace
                 embed_message = None
+                added_song = None
+                error = "cancelled"
+                if trace:
+                    trace.span_since("queued", "waiting for resolver")
                 try:
-                    song = await self._music_downloader.prepare_song(song_request.title)
-                    embed_message = added_to_queue(song, await self.queue_length())
+                    song = await self._retry_throttled(
+                        lambda: self._music_downloader.prepare_song(song_request.title, song_request.bitrate,
+                                                                  song_request.exact, trace))
+                    if trace:  # the song may be shared with the cache and other requests
+                        song = copy(song)
+                        song.trace = trace
+                        trace.mark("resolved")
+                    self._admission.add(self._guild_id, [song])  # replaces the request, which is released below
                     self._downloaded_songs.append(song)
+                    self._song_durations.append(song, song.duration)
+                    self._version += 1
+                    added_song = (song, await self.queue_length() - 1,
+                                  self._playback_remaining() + self.time_until(len(self._downloaded_songs) - 1))
                     self._song_available.set()
                 except PlaylistFoundException:
                     try:
                         playlist_extractor = PlaylistExtractor(song_request.title)
-                        playlist = await playlist_extractor.get_playlist_requests(song_request)
-                        self._waiting_queries.extend(playlist.songs)
+                        playlist = await self._retry_throttled(
+                            lambda: playlist_extractor.get_playlist_requests(song_request))
                         embed_message = added_playlist_to_queue(playlist)
+                        error = None
+                        try:
+                            self._admission.admit(self._guild_id, playlist.songs)
+                        except QueueAdmission.LimitReached as e:
+                            playlist.songs = playlist.songs[:e.admitted]
+                            embed_message = playlist_truncated(playlist, e.limit)
+                        self._waiting_queries.extend(playlist.songs)
+                        for playlist_song in playlist.songs:
+                            self._request_durations.append(playlist_song, playlist_song.duration)
+                        self._version += 1
                     except DownloaderException as e:
                         embed_message = e.embed(song_request.title)
+                        error = type(e).__name__
                 except DownloaderException as e:
                     embed_message = e.embed(song_request.title)
+                    error = type(e).__name__
                 except Exception as e:
                     if isinstance(e, asyncio.CancelledError):
                         raise e
                     embed_message = download_error(song_request.title)
+                    error = type(e).__name__
                     logging.error(e, exc_info=True)
                 finally:
-                    if not song_request.quiet:
-                        await song_request.ctx.send(embed=embed_message)
-                    self._waiting_queries.remove(song_request)
+                    if trace and not added_song:  # otherwise the trace is finished when the song starts playing
+                        trace.finish(error)
+                    # messages are sent in the background, so resolving is not held up by discord's rate limits
+                    if not song_request.quiet and added_song:
+                        self._message_batcher.song_added(song_request.channel, *added_song)
+                    elif not song_request.quiet and embed_message:
+                        self._message_batcher.send(song_request.channel, embed_message)
+                    if song_request in self._waiting_queries:  # unless the queue was cleared in the meantime
+                        self._waiting_queries.remove(song_request)
+                        self._request_durations.remove(song_request)
+                        self._version += 1
+                        self._admission.release(self._guild_id, [song_request])
         except asyncio.CancelledError:
             pass
         finally:
             self._processing_task = None
+
+    @staticmethod
+    async def _retry_throttled(get_result: Callable[[], Awaitable[T]]) -> T:
+        """
+        Pauses the queue while YouTube is throttling the requests and retries them afterwards,
+        instead of failing every waiting song.
+        """
+        for _ in range(MAX_THROTTLED_RETRIES):
+            try:
+                return await get_result()
+            except ThrottledException as e:
+                logging.warning(f"Request throttled by YouTube, retrying in {e.retry_after:.0f}s")
+                await asyncio.sleep(e.retry_after)
+        return await get_result()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from typing import Callable, TypeVar
+
+import requests
+import yt_dlp
+
+T = TypeVar("T")
+
+
+class ExtractionThrottle:
+    """
+    Shared guard for all requests made to YouTube, safe to use from worker threads.
+
+    Requests are limited by a token bucket. The refill rate is halved every time YouTube throttles
+    the bot and slowly recovers on success. After a number of consecutive throttling errors the circuit
+    opens and calls fail fast without reaching YouTube, the open time grows exponentially.
+    """
+
+    class Throttled(Exception):
+        def __init__(self, retry_after: float):
+            super().__init__(f"YouTube is throttling requests, retry after {retry_after:.1f}s")
+            self.retry_after = retry_after
+
+    class SearchThrottledError(Exception):
+        """
+        YouTube answered the search, but with a bot check or an empty page instead of the results.
+        """
+
+        def __init__(self, status_code: int):
+            super().__init__(f"Search results missing from the response (HTTP {status_code})")
+            self.status_code = status_code
+
+    _THROTTLING_MESSAGES = ("HTTP Error 429", "Too Many Requests", "not a bot", "rate-limited", "rate limit")
+
+    def __init__(self, rate: float, capacity: int, failure_threshold: int, base_backoff: float,
+                 max_backoff: float) -> None:
+        self._max_rate = rate
+        self._min_rate = rate / 16
+        self._rate = rate  # tokens per second
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._refilled_at = time.monotonic()
+        self._failure_threshold = failure_threshold
+        self._base_backoff = base_backoff
+        self._max_backoff = max_backoff
+        self._failures = 0  # consecutive throttling errors
+        self._open_until = 0.0
+        self._trial_in_flight = False  # half-open state lets a single call through to probe YouTube
+        self._lock = threading.Lock()
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Calls the function once the rate limit allows it.
+        :raises ExtractionThrottle.Throttled: when the circuit is open or YouTube throttled the call
+        """
+        trial = self._acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.is_throttling_error(e):
+                raise ExtractionThrottle.Throttled(self._record_failure()) from e
+            self._record_success(trial)  # YouTube answered, e.g. the video does not exist
+            raise
+        self._record_success(trial)
+        return result
+
+    @classmethod
+    def is_throttling_error(cls, error: Exception) -> bool:
+        if isinstance(error, ExtractionThrottle.SearchThrottledError):
+            return True
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code == 429
+        if isinstance(error, (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError)):
+            return any(message in str(error) for message in cls._THROTTLING_MESSAGES)
+        return False
+
+    def _acquire(self) -> bool:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._failures >= self._failure_threshold:
+                    if now < self._open_until:
+                        raise ExtractionThrottle.Throttled(self._open_until - now)
+                    if self._trial_in_flight:
+                        raise ExtractionThrottle.Throttled(self._base_backoff)
+                    self._trial_in_flight = True
+                    return True
+                self._tokens = min(self._capacity, self._tokens + (now - self._refilled_at) * self._rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return False
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def _record_success(self, trial: bool) -> None:
+        with self._lock:
+            if trial:
+                logging.info("YouTube responded again, closing the circuit")
+            self._trial_in_flight = False
+            self._failures = 0
+            self._rate = min(self._max_rate, self._rate * 1.1)
+
+    def _record_failure(self) -> float:
+        with self._lock:
+            self._trial_in_flight = False
+            self._failures += 1
+            self._rate = max(self._min_rate, self._rate / 2)
+            backoff = min(self._max_backoff, self._base_backoff * 2 ** (self._failures - 1))
+            if self._failures >= self._failure_threshold:
+                self._open_until = time.monotonic() + backoff
+                logging.warning(f"YouTube is throttling requests, circuit opened for {backoff:.0f}s")
+            return backoff
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from queue import SimpleQueue
+from typing import ContextManager, Iterator, Optional
+
+
+class Trace:
+    """
+    Timeline of a single song request, from the command message to the first audio frame sent to discord.
+    Spans can be recorded from any thread.
+    """
+
+    def __init__(self, sink: "TraceSink", guild_id: int, query: str, started_at: float) -> None:
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.guild_id = guild_id
+        self.query = query
+        self.started_at = started_at  # unix time, the time the command message was sent
+        self.spans: list[tuple[str, float, float]] = []  # (name, start, end) in seconds since started_at
+        self.error: Optional[str] = None
+        self._marks: dict[str, float] = {}
+        self._sink = sink
+        self._finished = False
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time())
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        self.spans.append((name, start - self.started_at, end - self.started_at))
+
+    def mark(self, name: str) -> None:
+        self._marks[name] = time.time()
+
+    def event(self, name: str) -> None:
+        now = time.time()
+        self.add_span(name, now, now)
+
+    def span_since(self, mark: str, name: str) -> None:
+        """
+        Adds a span lasting from the given mark until now, e.g. time spent waiting in the queue.
+        """
+        if mark in self._marks:
+            self.add_span(name, self._marks[mark], time.time())
+
+    def finish(self, error: Optional[str] = None) -> None:
+        if self._finished:  # e.g. the song is resumed after a stream error
+            return
+        self._finished = True
+        self.error = error
+        self._sink.export(self)
+
+    @property
+    def duration(self) -> float:
+        return max((end for _, _, end in self.spans), default=0.0)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "guild_id": self.guild_id,
+            "query": self.query,
+            "started_at": self.started_at,
+            "duration": round(self.duration, 4),
+            "error": self.error,
+            "spans": [{"name": name, "start": round(start, 4), "end": round(end, 4)}
+                      for name, start, end in self.spans],
+        }
+
+
+def span(trace: Optional[Trace], name: str) -> ContextManager:
+    return trace.span(name) if trace else nullcontext()
+
+
+class TraceSink:
+    """
+    Appends finished traces to a JSONL file from a background thread
+    and keeps the latest trace of every guild in memory.
+    The file is rotated once it reaches max_bytes, keeping backup_count older files.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backup_count: int) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._queue: SimpleQueue[Trace] = SimpleQueue()
+        self._last: dict[int, Trace] = {}  # guild_id: latest finished trace
+        self._writer = threading.Thread(target=self._write_traces, name="trace-writer", daemon=True)
+        self._writer.start()
+
+    def start(self, guild_id: int, query: str, started_at: float) -> Trace:
+        return Trace(self, guild_id, query, started_at)
+
+    def export(self, trace: Trace) -> None:
+        self._last[trace.guild_id] = trace
+        self._queue.put(trace)
+
+    def last(self, guild_id: int) -> Optional[Trace]:
+        return self._last.get(guild_id)
+
+    def _write_traces(self) -> None:
+        size = self._path.stat().st_size if self._path.exists() else 0
+        while True:
+            trace = self._queue.get()
+            line = json.dumps(trace.to_dict(), separators=(",", ":")) + "\n"
+            try:
+                if size and size + len(line) > self._max_bytes:
+                    self._rotate()
+                    size = 0
+                with self._path.open("a") as file:
+                    file.write(line)
+                size += len(line)
+            except OSError as e:
+                logging.error(f"Failed to write trace {trace.trace_id}: {e}")
+
+    def _rotate(self) -> None:
+        # traces.jsonl -> traces.jsonl.1 -> traces.jsonl.2, the oldest file is overwritten
+        for i in range(self._backup_count - 1, 0, -1):
+            backup = self._path.with_name(f"{self._path.name}.{i}")
+            if backup.exists():
+                os.replace(backup, self._path.with_name(f"{self._path.name}.{i + 1}"))
+        if self._backup_count:
+            os.replace(self._path, self._path.with_name(f"{self._path.name}.1"))
+        else:
+            self._path.unlink()
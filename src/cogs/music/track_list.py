@@ -0,0 +1,105 @@
+import asyncio
+import csv
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional, Union
+
+import aiohttp
+from discord import Attachment
+
+from .music_downloader import SongDownloader
+from .song import Song
+
+TrackResult = tuple[str, Union[Song, Exception]]  # (query, resolved song or the error)
+
+
+@dataclass
+class TrackListSummary:
+    added: list[Song] = field(default_factory=list)
+    deferred: int = 0  # entries left to the queue, because YouTube was throttling the requests
+    failed: list[tuple[str, str]] = field(default_factory=list)  # (query, reason)
+    duplicates: int = 0
+    truncated: bool = False  # the list had more entries than allowed
+    queue_limit: Optional[str] = None  # the queue limit which stopped loading the list, see QueueAdmission
+
+
+class TrackListReader:
+    """
+    Streams the lines of an attached text or CSV file and turns them into queries.
+    Every line is a URL or a search query, CSV columns (e.g. artist,title) are joined into a single query.
+    Empty lines, comments starting with # and repeated entries are skipped.
+    """
+
+    _header_words = {"url", "link", "query", "song", "title", "artist", "track", "name"}
+
+    def __init__(self, attachment: Attachment, max_entries: int, summary: TrackListSummary) -> None:
+        self._attachment = attachment
+        self._max_entries = max_entries
+        self._summary = summary
+
+    async def queries(self) -> AsyncIterator[str]:
+        seen: set[str] = set()
+        async with aiohttp.ClientSession() as session, session.get(self._attachment.url) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                query = self._parse_line(line.decode("utf-8", errors="replace"))
+                if not query:
+                    continue
+                if query.casefold() in seen:
+                    self._summary.duplicates += 1
+                    continue
+                if len(seen) >= self._max_entries:
+                    self._summary.truncated = True
+                    return
+                seen.add(query.casefold())
+                yield query
+
+    @classmethod
+    def _parse_line(cls, line: str) -> Optional[str]:
+        line = line.strip().lstrip("\ufeff")  # byte order mark of files saved by Excel
+        if not line or line.startswith("#"):
+            return None
+        cells = [cell.strip() for cell in next(csv.reader([line])) if cell.strip()]
+        if not cells or all(cell.casefold() in cls._header_words for cell in cells):
+            return None
+        if cells[0].startswith(("http://", "https://")):
+            return cells[0]
+        return " ".join(cells)
+
+
+class TrackListLoader:
+    """
+    Resolves the queries of a track list in batches while the list is still being read.
+    Batches are resolved concurrently, but returned in the order of the list.
+    """
+
+    def __init__(self, song_downloader: SongDownloader, batch_size: int, concurrency: int) -> None:
+        self._song_downloader = song_downloader
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+
+    async def load(self, queries: AsyncIterator[str], bitrate: Optional[int] = None) -> AsyncIterator[list[TrackResult]]:
+        slots = asyncio.Semaphore(self._concurrency)
+        batches: deque[asyncio.Task] = deque()
+
+        async def resolve(batch: list[str]) -> list[TrackResult]:
+            async with slots:
+                return list(zip(batch, await self._song_downloader.prepare_songs(batch, bitrate)))
+
+        try:
+            batch = []
+            async for query in queries:
+                batch.append(query)
+                if len(batch) == self._batch_size:
+                    batches.append(asyncio.create_task(resolve(batch)))
+                    batch = []
+                while batches and batches[0].done():
+                    yield batches.popleft().result()
+            if batch:
+                batches.append(asyncio.create_task(resolve(batch)))
+            while batches:
+                yield await batches[0]
+                batches.popleft()
+        finally:  # e.g. the player was stopped while loading
+            for task in batches:
+                task.cancel()
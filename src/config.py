@@ -1,3 +1,4 @@
+import logging
 from pathlib import Path
 
 ERROR_COLOR = 0xFF5555
@@ -6,9 +7,83 @@ INFO_COLOR = 0x89CFF0
 
 COOKIES_PATH = Path("cookies.txt")
 LOG_PATH = Path("bot.log")
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 10 MB
+LOG_BACKUP_COUNT = 3
+TRACES_PATH = Path("traces.jsonl")  # latency breakdown of every song request
+TRACES_MAX_BYTES = 10 * 1024 * 1024  # 10 MB, the file is rotated like the log
+TRACES_BACKUP_COUNT = 1
+QUEUE_STATE_DIR = Path("state")  # snapshots of the queues, restored after the bot restarts
+YT_DLP_LOG_LEVEL = logging.WARNING  # yt-dlp produces many debug lines for every extraction
+
+FAST_STARTUP = True  # import the music cog and warm up yt-dlp after logging in, instead of before
 
 CACHE_SIZE = 100
 QUERIES_CACHE_SIZE = 500
 
+SEARCH_INDEX_SIZE = 2000  # titles of resolved songs used to answer similar search queries without searching
+SEARCH_INDEX_CONFIDENCE = 0.9  # part of the query that has to match a known title
+SEARCH_INDEX_MIN_COVERAGE = 0.5  # part of the known title that has to be matched by the query
+
+# kbps, voice channel bitrates are rounded up to one of these, so the cache keeps at most one stream per tier
+AUDIO_BITRATE_TIERS = (64, 96, 128, 256, 384)
+
 NO_USERS_DISCONNECT_TIMEOUT = 60 * 20  # 20 minutes
 NO_MUSIC_DISCONNECT_TIMEOUT = 60 * 5  # 5 minutes
+
+DEFAULT_VOLUME = 1.0
+MAX_VOLUME = 2.0
+DEFAULT_CROSSFADE = 0  # seconds, 0 disables crossfade
+MAX_CROSSFADE = 12
+
+SEEK_STEP = 10  # seconds, default step of forward and rewind commands
+MAX_RESUME_ATTEMPTS = 3  # how many times a song is resumed after a stream error
+RESUME_TOLERANCE = 5  # seconds, stream ending earlier than this before the end of the song is treated as an error
+
+YOUTUBE_REQUESTS_PER_SECOND = 2.0  # shared by all guilds
+YOUTUBE_REQUESTS_BURST = 5
+THROTTLE_FAILURE_THRESHOLD = 3  # consecutive throttling errors after which requests to YouTube are paused
+THROTTLE_BASE_BACKOFF = 5  # seconds, doubled with every throttling error
+THROTTLE_MAX_BACKOFF = 60 * 5
+MAX_THROTTLED_RETRIES = 5  # how many times a throttled song request is retried before it fails
+YOUTUBE_WORKERS = 8  # threads making requests to YouTube, they may wait for the throttle for a long time
+
+MESSAGE_BATCH_WINDOW = 1.5  # seconds, songs added to the queue within this window are announced together
+
+QUEUE_SNAPSHOT_INTERVAL = 10  # seconds, only the queues that changed are saved
+QUEUE_SNAPSHOT_POSITION_INTERVAL = 60  # seconds, the position in the playing song alone is saved this often
+
+DEFAULT_PROFILE_DURATION = 30  # seconds
+MAX_PROFILE_DURATION = 120
+PROFILE_SAMPLING_INTERVAL = 0.01  # seconds
+LOOP_LAG_CHECK_INTERVAL = 0.1  # seconds
+LOOP_LAG_THRESHOLD = 0.25  # seconds, event loop blocked for longer than this is logged
+
+MAX_FFMPEG_PROCESSES = 64  # host-wide, further songs wait for a free slot
+FFMPEG_STALL_TIMEOUT = 20  # seconds without output from FFmpeg after which it is killed and the song resumed
+FFMPEG_ORPHAN_TIMEOUT = 30  # seconds after which a FFmpeg process that was never played is cleaned up
+FFMPEG_CHECK_INTERVAL = 5  # seconds
+
+FRAMES_PER_SECOND = 50  # discord sends 20 ms frames
+PLAYBACK_STATS_WINDOW = 1500  # frames, timings of the last 30 seconds of playback are kept per guild
+PLAYBACK_CHECK_INTERVAL = 30  # seconds
+MAX_UNDERRUN_RATIO = 0.01  # part of the frames which may wait for FFmpeg before a warning is logged
+MAX_FRAME_LATENESS = 60  # ms, 99th percentile of how late frames are sent before a warning is logged
+
+ESTIMATED_SONG_DURATION = 210  # seconds, used for the ETAs until a song in the queue is resolved
+
+MAX_GUILD_QUEUE_LENGTH = 1000  # songs waiting in the queue of a single guild
+MAX_GUILD_QUEUE_BYTES = 4 * 1024 * 1024  # estimated memory used by the queue of a single guild
+MAX_QUEUE_LENGTH = 50000  # songs waiting in the queues of all guilds
+MAX_QUEUE_BYTES = 256 * 1024 * 1024
+
+PLAYFILE_MAX_BYTES = 256 * 1024  # size of an attached track list
+PLAYFILE_MAX_ENTRIES = 500  # songs loaded from a single track list
+PLAYFILE_BATCH_SIZE = 10  # songs resolved by one yt-dlp instance in one thread
+PLAYFILE_CONCURRENT_BATCHES = 4
+
+RADIO_HISTORY_SIZE = 20000  # songs whose related songs are remembered for autoplay
+RADIO_HISTORY_WINDOW = 3  # a played song is related to this many songs played before it in the same guild
+RADIO_RECENT_SIZE = 30  # latest songs of a guild that autoplay doesn't pick again
+RADIO_RELATED_LIMIT = 25  # related videos fetched from YouTube when the play history knows none
+RADIO_MAX_DURATION = 900  # seconds, longer related videos (mixes, compilations) are not picked
+RADIO_MAX_ATTEMPTS = 3  # candidates tried before autoplay gives up on the current song
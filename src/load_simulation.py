@@ -0,0 +1,453 @@
+"""
+Load simulation of the music cog, without connecting to discord or YouTube.
+
+Hundreds of simulated guilds send commands to the real MusicCog through a commands.Bot which is never logged in.
+Voice clients consume the audio frames in real time, like discord's audio player does,
+and songs are resolved by a stub extractor with a configurable latency.
+The simulation reports the latency of the commands, errors, leaked tasks and the memory usage of the process.
+
+Usage: python load_simulation.py --guilds 200 --duration 3600
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import discord
+import numpy as np
+from discord.ext import commands
+
+from cogs.music import music_cog
+from cogs.music.admission import queue_admission
+from cogs.music.ffmpeg_supervisor import ffmpeg_supervisor
+from cogs.music.music_downloader import SongDownloader, NoResultsFoundException
+from cogs.music.song import Song
+from cogs.music.tracing import Trace, span
+from config import FRAMES_PER_SECOND
+
+_FRAME_SIZE = 3840  # bytes of 20 ms of 48 kHz stereo 16-bit PCM
+_FRAME_DURATION = 1 / FRAMES_PER_SECOND
+
+# (command, weight) of the commands sent by the simulated users
+_COMMANDS = [
+    ("play", 40), ("skip", 12), ("queue", 10), ("shuffle", 8), ("clear", 5), ("pause", 4), ("resume", 4),
+    ("forward", 4), ("loop", 3), ("autoplay", 2), ("volume", 3), ("stop", 3), ("playexact", 2),
+]
+
+
+@dataclass
+class SimulationConfig:
+    guilds: int
+    duration: float  # seconds
+    command_interval: float  # mean seconds between the commands of a guild
+    song_duration: tuple[int, int]  # seconds
+    resolve_latency: float  # mean seconds to resolve a song
+    failure_rate: float  # part of the songs which can't be resolved
+    stream_drop_rate: float  # part of the streams which end too early, so the song is resumed
+    catalog_size: int  # number of distinct songs the users request
+    report_interval: float  # seconds
+    trace_memory: bool
+
+
+class SilentSource(discord.AudioSource):
+    """
+    Stream of silent PCM frames, which may end too early like a dropped YouTube stream.
+    """
+
+    def __init__(self, duration: float, drop: bool) -> None:
+        self._frames = int(duration * FRAMES_PER_SECOND * (random.uniform(0.2, 0.8) if drop else 1))
+        self._frame = bytes(_FRAME_SIZE)
+
+    def read(self) -> bytes:
+        if self._frames <= 0:
+            return b""
+        self._frames -= 1
+        return self._frame
+
+
+@dataclass
+class SimulatedSong(Song):
+    drop_rate: float = 0.0
+
+    async def get_source(self, offset: float = 0) -> discord.AudioSource:
+        await asyncio.sleep(0.01)  # spawning FFmpeg
+        return SilentSource(max(self.duration - offset, 0), random.random() < self.drop_rate)
+
+
+class StubDownloader(SongDownloader):
+    """
+    Resolves every query to a song of the simulated catalog after a random delay, without contacting YouTube.
+    """
+
+    def __init__(self, config: SimulationConfig, *args) -> None:
+        super().__init__(*args)
+        self._config = config
+
+    def warm_up(self) -> None:
+        pass
+
+    def _construct_song(self, query: str, tier: int, trace: Optional[Trace], ydl=None) -> Song:
+        digest = hashlib.sha1(query.lower().encode()).digest()
+        with span(trace, "search"):
+            time.sleep(random.expovariate(2 / self._config.resolve_latency))
+        if random.random() < self._config.failure_rate:
+            raise NoResultsFoundException(query)
+        low, high = self._config.song_duration
+        with span(trace, "extraction"):
+            time.sleep(random.expovariate(2 / self._config.resolve_latency))
+        return SimulatedSong(title=f"Simulated {query}",
+                             url=f"https://www.youtube.com/watch?v={digest.hex()[:11]}",
+                             duration=low + int.from_bytes(digest[:4], "big") % (high - low + 1),
+                             thumbnail=None,
+                             expires_at=int(time.time()) + 6 * 3600,
+                             _stream_url="simulated://" + digest.hex(),
+                             drop_rate=self._config.stream_drop_rate)
+
+    def _refresh_song(self, url: str, tier: int) -> Song:
+        return self._construct_song(url, tier, None)
+
+    def _construct_songs(self, queries: list[str], tier: int) -> list:
+        results = []
+        for query in queries:
+            try:
+                results.append(self._construct_song(query, tier, None))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def related_urls(self, url: str) -> list[str]:
+        await asyncio.sleep(self._config.resolve_latency)
+        return [f"https://www.youtube.com/watch?v=related{random.randrange(self._config.catalog_size):04d}"
+                for _ in range(10)]
+
+
+class SimulatedAudioPlayer(threading.Thread):
+    """
+    Reads the frames of the source every 20 ms and calls after when it ends, like discord's AudioPlayer.
+    """
+
+    frames_sent = 0  # of all players, the increments may race, but it is only a rough rate
+
+    def __init__(self, source: discord.AudioSource, after: Optional[Callable[[Optional[Exception]], None]]) -> None:
+        super().__init__(daemon=True, name="SimulatedAudioPlayer")
+        self.source = source
+        self._after = after
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def run(self) -> None:
+        error = None
+        try:
+            started_at, frames = time.perf_counter(), 0
+            while not self._end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    started_at, frames = time.perf_counter(), 0
+                    continue
+                data = self.source.read()
+                if not data:
+                    break
+                frames += 1
+                SimulatedAudioPlayer.frames_sent += 1
+                delay = started_at + frames * _FRAME_DURATION - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            self.source.cleanup()
+            if self._after:
+                try:
+                    self._after(error)
+                except Exception as e:
+                    logging.error(f"Error in the after callback of the audio player: {e}", exc_info=True)
+
+    def stop(self) -> None:
+        self._end.set()
+        self._resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def pause(self) -> None:
+        self._resumed.clear()
+
+    def resume(self) -> None:
+        self._resumed.set()
+
+
+class SimulatedVoiceClient:
+    def __init__(self, guild: "SimulatedGuild", channel: "SimulatedVoiceChannel") -> None:
+        self.guild = guild
+        self.channel = channel
+        self._player: Optional[SimulatedAudioPlayer] = None
+
+    def play(self, source: discord.AudioSource, *, after=None) -> None:
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        self._player = SimulatedAudioPlayer(source, after)
+        self._player.start()
+
+    def is_playing(self) -> bool:
+        return self._player is not None and self._player.is_alive()
+
+    def is_paused(self) -> bool:
+        return self.is_playing() and self._player.paused
+
+    def stop(self) -> None:
+        if self._player:
+            self._player.stop()
+
+    def pause(self) -> None:
+        if self._player:
+            self._player.pause()
+
+    def resume(self) -> None:
+        if self._player:
+            self._player.resume()
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        self.stop()
+        self.guild.voice_client = None
+
+
+class SimulatedVoiceChannel:
+    bitrate = 64000
+
+    def __init__(self, guild: "SimulatedGuild", channel_id: int) -> None:
+        self.guild = guild
+        self.id = channel_id
+        self.name = f"voice-{channel_id}"
+        self.members = [SimpleNamespace(id=channel_id + 1, bot=False)]
+
+    async def connect(self, **kwargs) -> SimulatedVoiceClient:
+        await asyncio.sleep(0.05)
+        self.guild.voice_client = SimulatedVoiceClient(self.guild, self)
+        return self.guild.voice_client
+
+
+class SimulatedTextChannel:
+    def __init__(self, channel_id: int, stats: "SimulationStats") -> None:
+        self.id = channel_id
+        self._stats = stats
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None, **kwargs) -> None:
+        await asyncio.sleep(0.05)  # discord API
+        self._stats.messages[embed.title.strip() if embed else "text"] += 1
+
+
+class SimulatedGuild:
+    def __init__(self, guild_id: int, stats: "SimulationStats") -> None:
+        self.id = guild_id
+        self.voice_client: Optional[SimulatedVoiceClient] = None
+        self.voice_channel = SimulatedVoiceChannel(self, guild_id + 1)
+        self.text_channel = SimulatedTextChannel(guild_id + 2, stats)
+        self.member = SimpleNamespace(id=guild_id + 3, bot=False, voice=SimpleNamespace(channel=self.voice_channel))
+
+
+class SimulatedContext(commands.Context):
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.channel.send(content, **kwargs)
+
+
+class SimulationStats:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)  # command: seconds
+        self.window: list[float] = []  # latencies since the last report
+        self.command_errors: Counter[str] = Counter()  # expected errors, e.g. the bot is not connected
+        self.failures: Counter[str] = Counter()  # exceptions raised by the commands or background tasks
+        self.messages: Counter[str] = Counter()  # title of the embed: number of messages sent
+
+
+def _percentiles(latencies: list[float]) -> str:
+    if not latencies:
+        return "-"
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return f"p50 {p50:.1f} ms, p99 {p99:.1f} ms"
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as file:
+            return next(int(line.split()[1]) for line in file if line.startswith("VmRSS:")) / 1024
+    except (OSError, StopIteration):
+        return float("nan")
+
+
+class LoadSimulation:
+    def __init__(self, config: SimulationConfig) -> None:
+        self._config = config
+        self._stats = SimulationStats()
+        self._message_ids = itertools.count(1)
+        self._guilds = [SimulatedGuild(1000 * (i + 1), self._stats) for i in range(config.guilds)]
+        self._bot: Optional[commands.Bot] = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(self._on_loop_exception)
+        if self._config.trace_memory:
+            tracemalloc.start(10)
+
+        with tempfile.TemporaryDirectory() as directory:
+            self._bot = self._create_bot(Path(directory))
+            await self._bot.__aenter__()  # sets up the event loop of the bot without logging in
+            await self._bot.add_cog(music_cog.MusicCog(self._bot))
+            baseline_tasks = asyncio.all_tasks()
+            memory_snapshot = tracemalloc.take_snapshot() if self._config.trace_memory else None
+            started_at = time.monotonic()
+            initial_rss = _rss_mb()
+            rss_samples = [initial_rss]
+
+            users = [asyncio.create_task(self._simulate_guild(guild, started_at + self._config.duration))
+                     for guild in self._guilds]
+            reporter = asyncio.create_task(self._report_periodically(started_at, rss_samples))
+            await asyncio.gather(*users)
+            reporter.cancel()
+
+            # every guild stops its player, afterwards nothing should be left running
+            await asyncio.gather(*(self._invoke(guild, "stop") for guild in self._guilds))
+            await asyncio.sleep(5)
+            self._report_final(time.monotonic() - started_at, initial_rss, rss_samples,
+                               asyncio.all_tasks() - baseline_tasks - {asyncio.current_task()}, memory_snapshot)
+            await self._bot.remove_cog("MusicCog")
+            await self._bot.close()
+
+    def _create_bot(self, directory: Path) -> commands.Bot:
+        # the cog writes its state and traces to the temporary directory and resolves songs with the stub
+        music_cog.QUEUE_STATE_DIR = directory / "state"
+        music_cog.TRACES_PATH = directory / "traces.jsonl"
+        music_cog.SongDownloader = lambda *args: StubDownloader(self._config, *args)
+
+        intents = discord.Intents.default()
+        intents.message_content = True
+        bot = commands.Bot(command_prefix="!", intents=intents)
+        bot._connection.user = SimpleNamespace(id=1, bot=True)  # never logged in
+        bot.add_listener(self._on_command_error, "on_command_error")
+        return bot
+
+    async def _simulate_guild(self, guild: SimulatedGuild, deadline: float) -> None:
+        await asyncio.sleep(random.uniform(0, self._config.command_interval))
+        while time.monotonic() < deadline:
+            command = random.choices([name for name, _ in _COMMANDS], [weight for _, weight in _COMMANDS])[0]
+            await self._invoke(guild, command)
+            await asyncio.sleep(random.expovariate(1 / self._config.command_interval))
+
+    async def _invoke(self, guild: SimulatedGuild, command: str) -> None:
+        if command in ("play", "playexact"):
+            # popular songs are requested more often, so some of them are found in the cache
+            command += f" song {int(random.paretovariate(1.2)) % self._config.catalog_size}"
+        elif command == "volume":
+            command += f" {random.randint(10, 150)}"
+        message = SimpleNamespace(id=next(self._message_ids), content=f"!{command}", author=guild.member,
+                                  guild=guild, channel=guild.text_channel, attachments=[], _state=None,
+                                  created_at=datetime.now(timezone.utc))
+        ctx = await self._bot.get_context(message, cls=SimulatedContext)
+        started_at = time.perf_counter()
+        await self._bot.invoke(ctx)
+        latency = time.perf_counter() - started_at
+        self._stats.latencies[command.split()[0]].append(latency)
+        self._stats.window.append(latency)
+
+    async def _on_command_error(self, ctx: commands.Context, error: commands.CommandError) -> None:
+        if isinstance(error, commands.CommandInvokeError):
+            self._stats.failures[f"!{ctx.command}: {type(error.original).__name__}: {error.original}"] += 1
+            logging.error(f"!{ctx.command} failed", exc_info=error.original)
+        else:
+            self._stats.command_errors[f"!{ctx.command}: {error}"] += 1
+
+    def _on_loop_exception(self, loop: asyncio.AbstractEventLoop, context: dict) -> None:
+        exception = context.get("exception")
+        self._stats.failures[f"{context['message']}: {type(exception).__name__ if exception else ''}"] += 1
+        loop.default_exception_handler(context)
+
+    async def _report_periodically(self, started_at: float, rss_samples: list[float]) -> None:
+        frames = SimulatedAudioPlayer.frames_sent
+        while True:
+            await asyncio.sleep(self._config.report_interval)
+            rss_samples.append(_rss_mb())
+            frame_rate = (SimulatedAudioPlayer.frames_sent - frames) / self._config.report_interval
+            frames = SimulatedAudioPlayer.frames_sent
+            print(f"[{time.monotonic() - started_at:7.0f}s] {len(self._stats.window)} commands "
+                  f"({_percentiles(self._stats.window)}), "
+                  f"{sum(1 for guild in self._guilds if guild.voice_client)} players, "
+                  f"{frame_rate:.0f} frames/s, {len(asyncio.all_tasks())} tasks, "
+                  f"{threading.active_count()} threads, {ffmpeg_supervisor.process_count} sources, "
+                  f"{queue_admission.total.entries} queued, RSS {rss_samples[-1]:.1f} MB, "
+                  f"{sum(self._stats.failures.values())} failures", flush=True)
+            self._stats.window = []
+
+    def _report_final(self, elapsed: float, initial_rss: float, rss_samples: list[float], leaked_tasks: set,
+                      memory_snapshot: Optional[tracemalloc.Snapshot]) -> None:
+        final_rss = _rss_mb()
+        lines = ["", f"Simulated {self._config.guilds} guilds for {elapsed:.0f}s", "", "Command latency:"]
+        lines += [f"  !{command:<10} {len(latencies):7d} calls, {_percentiles(latencies)}"
+                  for command, latencies in sorted(self._stats.latencies.items())]
+        growth = f"{final_rss - initial_rss:+.1f} MB"
+        if elapsed >= 600:  # shorter runs are dominated by the caches and the queues filling up
+            growth += f", {(final_rss - initial_rss) / (elapsed / 3600):+.1f} MB/h"
+        lines += ["", f"Memory: RSS {initial_rss:.1f} MB at start, {max(rss_samples + [final_rss]):.1f} MB at peak, "
+                      f"{final_rss:.1f} MB at the end ({growth})"]
+        lines += [f"Left after stopping all players: {len(leaked_tasks)} tasks, "
+                  f"{sum(1 for thread in threading.enumerate() if isinstance(thread, SimulatedAudioPlayer))} "
+                  f"audio players, {ffmpeg_supervisor.process_count} audio sources, "
+                  f"{queue_admission.total.entries} queue entries"]
+        tasks = Counter(getattr(task.get_coro(), "__qualname__", repr(task.get_coro())) for task in leaked_tasks)
+        lines += [f"  {count}x {name}" for name, count in tasks.most_common(10)]
+        lines += ["", f"Failures ({sum(self._stats.failures.values())}):"]
+        lines += [f"  {count}x {failure}" for failure, count in self._stats.failures.most_common(10)] or ["  none"]
+        lines += ["", "Expected command errors:"]
+        lines += [f"  {count}x {error}" for error, count in self._stats.command_errors.most_common(10)] or ["  none"]
+        lines += ["", "Messages sent:"]
+        lines += [f"  {count}x {title}" for title, count in self._stats.messages.most_common(15)]
+        if memory_snapshot:
+            lines += ["", "Memory growth by allocation site:"]
+            ignored = [tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                       tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")]  # lazy imports
+            lines += [f"  {stat}" for stat in tracemalloc.take_snapshot().filter_traces(ignored)
+                      .compare_to(memory_snapshot.filter_traces(ignored), "lineno")[:10]]
+        print("\n".join(lines), flush=True)
+
+
+def parse_args() -> SimulationConfig:
+    parser = argparse.ArgumentParser(description="Simulate many guilds using the music cog at once.")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=300, help="seconds to send commands for")
+    parser.add_argument("--command-interval", type=float, default=5, help="mean seconds between commands of a guild")
+    parser.add_argument("--song-duration", type=int, nargs=2, default=(10, 60), metavar=("MIN", "MAX"))
+    parser.add_argument("--resolve-latency", type=float, default=0.5, help="mean seconds to resolve a song")
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--stream-drop-rate", type=float, default=0.02)
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--report-interval", type=float, default=30, help="seconds")
+    parser.add_argument("--trace-memory", action="store_true", help="report memory growth by allocation site")
+    args = parser.parse_args()
+    return SimulationConfig(guilds=args.guilds,
+                            duration=args.duration,
+                            command_interval=args.command_interval,
+                            song_duration=tuple(args.song_duration),
+                            resolve_latency=args.resolve_latency,
+                            failure_rate=args.failure_rate,
+                            stream_drop_rate=args.stream_drop_rate,
+                            catalog_size=args.catalog_size,
+                            report_interval=args.report_interval,
+                            trace_memory=args.trace_memory)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(LoadSimulation(parse_args()).run())
@@ -1,13 +1,19 @@
 import asyncio
+import importlib
+
+from utils import load_token, setup_logging, StartupTimer
+
+startup_timer = StartupTimer()
 
 import discord
 from discord.ext import commands
 import logging
-from utils import load_token, setup_logging
-from cogs.music.music_cog import MusicCog
 from help_message import HelpMessage
+from cogs.admin.admin_cog import AdminCog
 from config import *
 
+startup_timer.mark("imports")
+
 intents = discord.Intents.default()
 intents.message_content = True  # Required for commands to be able to read arguments
 
@@ -19,13 +25,51 @@ bot: commands.Bot = commands.Bot(
 )
 
 
+background_tasks: set[asyncio.Task] = set()
+
+
+@bot.event
+async def setup_hook() -> None:
+    """
+    Called after logging in, before connecting to the gateway.
+    """
+    startup_timer.mark("login")
+    task = asyncio.create_task(start_music_cog())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
 @bot.event
 async def on_ready() -> None:
+    startup_timer.mark("gateway ready")
     message = f"Logged in as {bot.user} (ID: {bot.user.id})"
     logging.info(message)
     logging.info("-" * len(message))
 
 
+async def load_music_cog() -> None:
+    # yt-dlp and the rest of the music cog take a while to import, with FAST_STARTUP
+    # it is done in a worker thread while the bot is already connecting to the gateway
+    music_cog = await asyncio.to_thread(importlib.import_module, "cogs.music.music_cog")
+    await bot.add_cog(music_cog.MusicCog(bot))
+    startup_timer.mark("music cog import")
+
+
+async def start_music_cog() -> None:
+    try:
+        if FAST_STARTUP:
+            await load_music_cog()
+        await bot.wait_until_ready()
+        music_cog = bot.get_cog("MusicCog")
+        await music_cog.warm_up()
+        startup_timer.mark("extractor warm-up")
+        await music_cog.restore_players()
+        startup_timer.mark("queues restore")
+        logging.info(startup_timer.summary())
+    except Exception as e:
+        logging.error(e, exc_info=True)
+
+
 @bot.event
 async def on_command_error(ctx: commands.Context, error: Exception) -> None:
     """
@@ -36,6 +80,10 @@ async def on_command_error(ctx: commands.Context, error: Exception) -> None:
         await ctx.send(embed=discord.Embed(title="🤷‍ Command Not Found️",
                                            description="Type `!help` to see the list of available commands",
                                            color=ERROR_COLOR))
+    elif isinstance(error, commands.NotOwner):
+        await ctx.send(embed=discord.Embed(title="⛔ Not Allowed",
+                                           description="Only the owner of the bot can use this command",
+                                           color=ERROR_COLOR))
     elif isinstance(error, commands.MissingRequiredArgument):
         await ctx.send(embed=discord.Embed(title=f"🤔 Oops! You’re missing something!",
                                            description=f"Type `!help {ctx.command.name}` for more information",
@@ -45,16 +93,20 @@ async def on_command_error(ctx: commands.Context, error: Exception) -> None:
 
 
 async def main() -> None:
+    log_listener = setup_logging(logging.INFO, enable_file_logging=True)
     try:
         token = load_token()
-        setup_logging(logging.INFO, enable_file_logging=True)
         async with bot:
-            await bot.add_cog(MusicCog(bot))
+            await bot.add_cog(AdminCog(bot))
+            if not FAST_STARTUP:
+                await load_music_cog()
             await bot.start(token)
     except discord.LoginFailure:
         logging.error("Failed to log in. Ensure the token is correct.")
     except Exception as e:
         logging.error(e, exc_info=True)
+    finally:
+        log_listener.stop()
 
 
 if __name__ == '__main__':
@@ -1,9 +1,14 @@
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from os import getenv
+from queue import SimpleQueue
 from sys import stdout
+from time import perf_counter
 
 from dotenv import load_dotenv
 
+from config import LOG_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+
 
 def load_token() -> str:
     load_dotenv()
@@ -15,18 +20,52 @@ def load_token() -> str:
     return token
 
 
-def setup_logging(level: int = logging.INFO, enable_file_logging: bool = False) -> None:
-    logger = logging.getLogger()
-    logger.setLevel(level)
+class StartupTimer:
+    """
+    Measures how long each stage of the bot startup takes.
+    """
+
+    def __init__(self) -> None:
+        self._started_at = perf_counter()
+        self._last_mark = self._started_at
+        self._stages: dict[str, float] = {}  # stage: seconds since the previous stage
+
+    def mark(self, stage: str) -> None:
+        if stage in self._stages:  # e.g. on_ready is called again after reconnecting
+            return
+        now = perf_counter()
+        self._stages[stage] = now - self._last_mark
+        self._last_mark = now
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{stage}: {seconds:.2f}s" for stage, seconds in self._stages.items())
+        return f"Startup took {self._last_mark - self._started_at:.2f}s ({stages})"
+
+
+def setup_logging(level: int = logging.INFO, enable_file_logging: bool = False) -> QueueListener:
+    """
+    Log records are put on a queue by the calling thread and written by a background thread,
+    so slow disk or console I/O never blocks the event loop.
+    The returned listener has to be stopped before exiting to flush the remaining records.
+    """
     formatter = logging.Formatter("%(asctime)-15s - %(name)-25s - %(levelname)-5s - %(message)s")
 
     console_handler = logging.StreamHandler(stream=stdout)
     console_handler.setFormatter(formatter)
     console_handler.setLevel(level)
-    logger.addHandler(console_handler)
+    handlers: list[logging.Handler] = [console_handler]
 
     if enable_file_logging:
-        file_handler = logging.FileHandler("bot.log", mode="w")
+        file_handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
         file_handler.setFormatter(formatter)
         file_handler.setLevel(level)
-        logger.addHandler(file_handler)
\ No newline at end of file
+        handlers.append(file_handler)
+
+    log_queue = SimpleQueue()
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(QueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener